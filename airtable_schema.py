@@ -0,0 +1,159 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+CACHE_DIR = os.path.join(".dbagent_cache", "airtable")
+# Seconds between background syncs; changed records only
+REFRESH_SECONDS = int(os.environ.get("DBAGENT_AIRTABLE_REFRESH_SECONDS", 300))
+# Deleted records are only noticed by a full sync
+FULL_SYNC_SECONDS = int(os.environ.get("DBAGENT_AIRTABLE_FULL_SYNC_SECONDS", 24 * 3600))
+# Overlap between syncs, so edits made while one ran are picked up by the next
+WATERMARK_SKEW_SECONDS = 60
+RECORD_ID = "_record_id"
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _cell(value):
+    # Linked records, attachments and multi-selects are lists/dicts; store them as JSON text
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def records_frame(records):
+    """One row per Airtable record, keyed by record id."""
+    rows = [{RECORD_ID: record["id"], **{k: _cell(v) for k, v in record["fields"].items()}} for record in records]
+    return pd.DataFrame(rows, columns=None if rows else [RECORD_ID])
+
+
+class SchemaSnapshot:
+    """Airtable table mirrored to a local Parquet file and kept in memory.
+
+    Reads never wait on Airtable once a snapshot exists: it is loaded from disk
+    and refreshed by a background thread that only fetches records modified
+    since the last sync.
+    """
+
+    def __init__(self, table, path, refresh_seconds=REFRESH_SECONDS, full_sync_seconds=FULL_SYNC_SECONDS):
+        self.table = table
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.full_sync_seconds = full_sync_seconds
+        self.frame = None
+        self.version = 0
+        self.watermark = None
+        self.last_full_sync = 0.0
+        self.last_error = None
+        self._derived = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._load()
+
+    def _meta_path(self):
+        return self.path + ".json"
+
+    def _load(self):
+        try:
+            frame = pd.read_parquet(self.path)
+            with open(self._meta_path()) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._set(frame, meta.get("watermark"), meta.get("last_full_sync", 0.0))
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.frame.astype({c: str for c in self.frame.columns if self.frame[c].dtype == object}) \
+            .to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, self.path)
+        with open(self._meta_path(), "w") as f:
+            json.dump({"watermark": self.watermark, "last_full_sync": self.last_full_sync}, f)
+
+    def _set(self, frame, watermark, last_full_sync):
+        with self._lock:
+            self.frame = frame
+            self.watermark = watermark
+            self.last_full_sync = last_full_sync
+            self.version += 1
+            self._derived.clear()
+
+    def sync(self, full=False):
+        """Fetch changes from Airtable (everything when full) and persist the merged snapshot."""
+        started = datetime.datetime.now(datetime.timezone.utc)
+        full = full or self.frame is None or self.watermark is None \
+            or time.time() - self.last_full_sync > self.full_sync_seconds
+        if full:
+            frame = records_frame(self.table.all())
+            last_full_sync = time.time()
+        else:
+            formula = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{self.watermark}'))"
+            changed = records_frame(self.table.all(formula=formula))
+            if changed.empty:
+                frame = self.frame
+            else:
+                kept = self.frame[~self.frame[RECORD_ID].isin(changed[RECORD_ID])]
+                frame = pd.concat([kept, changed], ignore_index=True)
+            last_full_sync = self.last_full_sync
+        watermark = (started - datetime.timedelta(seconds=WATERMARK_SKEW_SECONDS)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        if frame is self.frame:
+            # Nothing changed: derived values stay valid and only the watermark moves
+            with self._lock:
+                self.watermark = watermark
+        else:
+            self._set(frame, watermark, last_full_sync)
+        self._save()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.sync()
+                self.last_error = None
+            except Exception as e:
+                # A failed refresh keeps serving the previous snapshot
+                self.last_error = str(e)
+
+    def start(self):
+        """Load synchronously if there is no snapshot yet, then keep refreshing in the background."""
+        if self.frame is None:
+            self.sync(full=True)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="airtable-schema-sync", daemon=True)
+                self._thread.start()
+        return self
+
+    def derived(self, build):
+        """build(frame), computed once per snapshot version."""
+        # Keyed by name: Streamlit re-executes the script, so each rerun defines a new function object
+        key = (build.__module__, build.__qualname__)
+        with self._lock:
+            frame, version = self.frame, self.version
+            cached = self._derived.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        value = build(frame)
+        with self._lock:
+            self._derived[key] = (version, value)
+        return value
+
+
+def get_schema_snapshot(personal_access_token, base_id, table_id):
+    """Process-wide, background-refreshed snapshot of an Airtable table."""
+    key = (base_id, table_id)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            from pyairtable import Table
+            table = Table(personal_access_token, base_id, table_id)
+            path = os.path.join(CACHE_DIR, f"{base_id}_{table_id}.parquet")
+            snapshot = _snapshots[key] = SchemaSnapshot(table, path)
+        # Sessions starting together wait for one initial sync instead of each running their own
+        return snapshot.start()
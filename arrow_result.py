@@ -0,0 +1,228 @@
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+from query_pipeline import empty_frame
+
+# Rows shown before the user asks for more
+PAGE_ROWS = int(os.environ.get("DBAGENT_PAGE_ROWS", 10000))
+# Hard caps on what one result may hold in memory, whatever the query returns
+MAX_RESULT_ROWS = int(os.environ.get("DBAGENT_MAX_RESULT_ROWS", 1000000))
+MAX_RESULT_BYTES = int(os.environ.get("DBAGENT_MAX_RESULT_BYTES", 512 * 1024 * 1024))
+# Row limit added to preview runs
+PREVIEW_ROWS = int(os.environ.get("DBAGENT_PREVIEW_ROWS", 1000))
+
+
+class ArrowResult:
+    """A query result held as a pyarrow Table.
+
+    Slices share the table's buffers, and pandas frames are only built, once per
+    column set, when something needs them (chart code, the rule engine, the profile).
+    """
+
+    # Fully fetched; PagedResult may hold only the first pages
+    complete = True
+    capped = False
+
+    def __init__(self, table):
+        self.table = table
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pandas(cls, frame):
+        return cls(pa.Table.from_pandas(frame, preserve_index=False))
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def slice(self, offset=0, length=None):
+        """Zero-copy view of a row range."""
+        return ArrowResult(self.table.slice(offset, length))
+
+    def select(self, columns):
+        """Zero-copy view of some columns."""
+        return ArrowResult(self.table.select(list(columns)))
+
+    def to_pandas(self, columns=None):
+        """pandas frame of the given columns (all by default), converted on first use and kept."""
+        key = tuple(columns) if columns is not None else None
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                table = self.table if key is None else self.table.select(list(key))
+                # split_blocks avoids the consolidation copy of same-typed columns
+                frame = table.to_pandas(split_blocks=True)
+                self._frames[key] = frame
+            return frame
+
+    def drop_frames(self):
+        """Forget converted pandas frames; the Arrow table is kept."""
+        with self._lock:
+            self._frames.clear()
+
+    def describe(self):
+        """Column names and Arrow types, without converting any rows."""
+        return ", ".join(f"{field.name} {field.type}" for field in self.table.schema)
+
+
+class PagedResult(ArrowResult):
+    """A result whose remaining pages are fetched only when asked for.
+
+    Built from Snowflake result batches, which download independently of the
+    cursor, so more rows can be loaded on a later rerun after the connection has
+    gone back to the pool. Loading stops at max_rows / max_bytes.
+    """
+
+    def __init__(self, batches, empty_table, page_rows=PAGE_ROWS, max_rows=MAX_RESULT_ROWS,
+                 max_bytes=MAX_RESULT_BYTES):
+        super().__init__(empty_table)
+        self._pending = list(batches)
+        self._tables = []
+        self._truncated = False
+        self.page_rows = page_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.total_rows = sum(batch.rowcount for batch in self._pending)
+        # Called once with the result when its last page is loaded, e.g. to cache it
+        self.on_complete = None
+        self.load_more()
+
+    @property
+    def complete(self):
+        return not self._has_pending() and not self._truncated
+
+    @property
+    def capped(self):
+        """Whether the row or byte cap stopped loading before the end of the result."""
+        if self._truncated:
+            return True
+        return self._has_pending() and (self.num_rows >= self.max_rows or self.nbytes >= self.max_bytes)
+
+    def load_more(self, rows=None):
+        """Fetch about one more page of rows; returns False once nothing more can be loaded."""
+        if self.complete or self.capped:
+            return False
+        target = min(self.num_rows + (rows or self.page_rows), self.max_rows)
+        loaded_rows, loaded_bytes = self.num_rows, self.nbytes
+        while self._has_pending() and loaded_rows < target and loaded_bytes < self.max_bytes:
+            table = self._next_table()
+            if loaded_rows + table.num_rows > self.max_rows:
+                table = table.slice(0, self.max_rows - loaded_rows)
+                self._truncated = True
+            self._tables.append(table)
+            loaded_rows += table.num_rows
+            loaded_bytes += table.nbytes
+        if self._tables:
+            tables = [t for t in self._tables if t.num_rows] or self._tables[:1]
+            self.table = concat_tables(tables)
+        # Frames converted from the shorter table are stale now
+        self.drop_frames()
+        if self.complete and self.on_complete is not None:
+            on_complete, self.on_complete = self.on_complete, None
+            on_complete(self)
+        return True
+
+    def load_all(self):
+        """Load every remaining page, up to the row and byte caps."""
+        while self.load_more():
+            pass
+
+    def _has_pending(self):
+        return bool(self._pending)
+
+    def _next_table(self):
+        return self._pending.pop(0).to_arrow()
+
+
+class StreamedResult(PagedResult):
+    """PagedResult over a lazy stream of Arrow record batches whose row count is known up front.
+
+    Used for BigQuery, whose row iterator streams batches from the Storage Read
+    API on demand, so later pages can still be loaded on a later rerun.
+    """
+
+    def __init__(self, batches, empty_table, total_rows, page_rows=PAGE_ROWS, max_rows=MAX_RESULT_ROWS,
+                 max_bytes=MAX_RESULT_BYTES):
+        self._stream = iter(batches)
+        # One batch is read ahead so the end of the stream is known without a further request
+        self._next = next(self._stream, None)
+        super().__init__([], empty_table, page_rows, max_rows, max_bytes)
+        self.total_rows = total_rows
+
+    def _has_pending(self):
+        return self._next is not None
+
+    def _next_table(self):
+        batch, self._next = self._next, next(self._stream, None)
+        return pa.Table.from_batches([batch])
+
+
+def concat_tables(tables):
+    """One Table from several, widening types where they disagree (e.g. int8 vs int16)."""
+    try:
+        return pa.concat_tables(tables)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.concat_tables(tables, promote_options="permissive")
+
+
+def concat_batches(batches):
+    """One Table from record batches, widening types where chunks disagree (e.g. int8 vs int16)."""
+    try:
+        return pa.Table.from_batches(batches)
+    except pa.ArrowInvalid:
+        return pa.concat_tables([pa.Table.from_batches([batch]) for batch in batches], promote_options="permissive")
+
+
+def fetch_arrow(cursor):
+    """Read an executed cursor into an ArrowResult batch by batch, never building a pandas frame."""
+    batches = list(cursor.fetch_arrow_batches())
+    if batches:
+        return ArrowResult(concat_batches(batches))
+    # Empty results yield no batches; the schema comes from the cursor description instead
+    return ArrowResult.from_pandas(empty_frame(cursor.description))
+
+
+def fetch_pages(cursor, page_rows=PAGE_ROWS, max_rows=MAX_RESULT_ROWS, max_bytes=MAX_RESULT_BYTES):
+    """First page of an executed cursor's result, with the rest left to load on demand."""
+    batches = cursor.get_result_batches()
+    if batches is None:
+        return fetch_arrow(cursor)
+    empty_table = ArrowResult.from_pandas(empty_frame(cursor.description)).table
+    return PagedResult(batches, empty_table, page_rows, max_rows, max_bytes)
+
+
+def as_frame(result):
+    """pandas view of a result, whether it is an ArrowResult or already a DataFrame."""
+    if isinstance(result, ArrowResult):
+        return result.to_pandas()
+    return result
+
+
+def chart_frame(result):
+    """pandas view of everything a chart should show: the whole result, loaded up to the caps.
+
+    Charts drawn from the first page alone would silently leave rows out;
+    plot_reduction shrinks large frames before they reach the browser.
+    """
+    if isinstance(result, PagedResult):
+        result.load_all()
+    return as_frame(result)
+
+
+def is_result(result):
+    return isinstance(result, (ArrowResult, pd.DataFrame))
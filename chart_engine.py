@@ -0,0 +1,188 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objs as go
+from plotly.subplots import make_subplots
+
+from data_profile import as_datetime, column_roles
+from plot_reduction import reduce_for_plot
+
+# Brand palette: purple shades on a white background
+PALETTE = ["#5B2C83", "#7E57C2", "#B39DDB", "#4A148C", "#9575CD", "#D1C4E9", "#311B92", "#CE93D8"]
+TEMPLATE = "plotly_white"
+MAX_SERIES = 12
+MAX_CATEGORIES = 30
+# Generated chart programs kept per result signature
+CHART_CODE_CACHE_SIZE = 64
+
+
+def likely_chartable(columns_frame):
+    """Whether the column types alone suggest recommend_chart will handle the result."""
+    dates, dimensions, metrics = column_roles(columns_frame)
+    return bool(metrics) and len(dates) + len(dimensions) in (1, 2) and len(dates) <= 1
+
+
+def _style(fig, title):
+    fig.update_layout(template=TEMPLATE, title=title, legend_title_text="", font_color="#2E1A47")
+    return fig
+
+
+def recommend_chart(df):
+    """Build a Plotly figure for common result shapes, or None when the LLM should decide."""
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return None
+    df = reduce_for_plot(df)
+    dates, dimensions, metrics = column_roles(df)
+    if not metrics or len(dates) > 1:
+        return None
+
+    if dates:
+        date = dates[0]
+        data = df.assign(**{date: as_datetime(df[date])}).sort_values(date)
+        if not dimensions:
+            # date x metric(s)
+            fig = px.line(data, x=date, y=metrics, color_discrete_sequence=PALETTE, markers=len(data) <= 60)
+            return _style(fig, f"{', '.join(metrics)} over {date}")
+        if len(dimensions) == 1 and len(metrics) == 1 and df[dimensions[0]].nunique() <= MAX_SERIES:
+            # date x dimension x metric
+            dimension, metric = dimensions[0], metrics[0]
+            fig = px.line(data, x=date, y=metric, color=dimension, color_discrete_sequence=PALETTE)
+            return _style(fig, f"{metric} over {date} by {dimension}")
+        return None
+
+    if len(dimensions) == 1 and df[dimensions[0]].nunique() <= MAX_CATEGORIES:
+        # category x metric(s)
+        dimension = dimensions[0]
+        data = df.sort_values(metrics[0], ascending=False)
+        fig = px.bar(data, x=dimension, y=metrics, barmode="group", color_discrete_sequence=PALETTE)
+        return _style(fig, f"{', '.join(metrics)} by {dimension}")
+    if (len(dimensions) == 2 and len(metrics) == 1 and df[dimensions[0]].nunique() <= MAX_CATEGORIES
+            and df[dimensions[1]].nunique() <= MAX_SERIES):
+        # category x category x metric
+        fig = px.bar(df, x=dimensions[0], y=metrics[0], color=dimensions[1], barmode="group",
+                     color_discrete_sequence=PALETTE)
+        return _style(fig, f"{metrics[0]} by {dimensions[0]} and {dimensions[1]}")
+    return None
+
+
+def _dtype_family(series):
+    # Coarse type, so a described (empty) frame and its fetched rows get the same signature
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_integer_dtype(series):
+        return "integer"
+    if pd.api.types.is_numeric_dtype(series):
+        return "float"
+    if as_datetime(series) is not None:
+        return "datetime"
+    return "text"
+
+
+def result_signature(df):
+    """Column names and dtype families identifying the shape of a result."""
+    return tuple((str(name), _dtype_family(df[name])) for name in df.columns)
+
+
+class ChartCodeCache:
+    """LRU of generated chart code per result signature, holding the source and its compiled code."""
+
+    def __init__(self, max_entries=CHART_CODE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, df):
+        """Compiled code for the signature of df, or None."""
+        key = result_signature(df)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def contains(self, df):
+        with self._lock:
+            return result_signature(df) in self._entries
+
+    def put(self, df, source):
+        """Compile source and store it for the signature of df; SyntaxError propagates uncached."""
+        code = compile(source, "<chart code>", "exec")
+        key = result_signature(df)
+        with self._lock:
+            self._entries[key] = (source, code)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return code
+
+    def invalidate(self, df):
+        with self._lock:
+            if self._entries.pop(result_signature(df), None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_chart_code_cache():
+    """Process-wide chart code cache, shared across Streamlit sessions and reruns."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ChartCodeCache()
+        return _cache
+
+
+def chart_ready(columns_frame):
+    """Whether a result with these columns can be charted without asking the model."""
+    return likely_chartable(columns_frame) or get_chart_code_cache().contains(columns_frame)
+
+
+def _exec_chart(code, df):
+    local_scope = {}
+    exec(code, {'pd': pd, 'px': px, 'go': go, 'make_subplots': make_subplots, 'df': df}, local_scope)
+    return local_scope.get('fig')
+
+
+def cached_chart(df):
+    """Figure from chart code generated earlier for the same columns, or None."""
+    cache = get_chart_code_cache()
+    code = cache.get(df)
+    if code is None:
+        return None
+    try:
+        fig = _exec_chart(code, reduce_for_plot(df))
+    except Exception:
+        fig = None
+    if fig is None:
+        cache.invalidate(df)
+    return fig
+
+
+def run_chart_code(chart_code, df):
+    """Execute generated Plotly code against df and return the `fig` it defines.
+
+    Large results are reduced first (see plot_reduction). The compiled code is
+    cached for df's column signature unless it raises or defines no figure.
+    """
+    cache = get_chart_code_cache()
+    code = cache.put(df, chart_code)
+    try:
+        fig = _exec_chart(code, reduce_for_plot(df))
+    except Exception:
+        cache.invalidate(df)
+        raise
+    if fig is None:
+        cache.invalidate(df)
+    return fig
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+
+import streamlit as st
+
+from arrow_result import ArrowResult, chart_frame, is_result
+from chart_engine import cached_chart, recommend_chart
+
+# Turns listed in the history panel; older ones are summarized in a caption
+MAX_RENDERED_TURNS = 20
+# Result frames kept in the session; older results are re-loaded (normally from the result cache) on demand
+MAX_RESULT_FRAMES = 10
+
+
+class Turn:
+    """One question with the SQL that answered it and how its result can be found again."""
+
+    def __init__(self, turn_id, question, sql, error=None):
+        self.turn_id = turn_id
+        self.question = question
+        self.sql = sql
+        self.error = error
+
+
+class HistoryStore:
+    """Per-session record of turns, with results and figures kept once per turn id."""
+
+    def __init__(self, max_frames=MAX_RESULT_FRAMES):
+        self.turns = []
+        self.max_frames = max_frames
+        self._frames = OrderedDict()
+        self._figures = {}
+
+    def add(self, question, sql, result, fig=None):
+        """Record a finished turn; result is its ArrowResult or the error text."""
+        if is_result(result):
+            turn = Turn(len(self.turns), question, sql)
+            self._keep_frame(turn.turn_id, result)
+            if fig is not None:
+                self._figures[turn.turn_id] = fig
+        else:
+            turn = Turn(len(self.turns), question, sql, error=str(result))
+        self.turns.append(turn)
+        return turn
+
+    def _keep_frame(self, turn_id, frame):
+        # Only the Arrow table is kept; the table view reads it directly
+        if isinstance(frame, ArrowResult):
+            frame.drop_frames()
+        self._frames[turn_id] = frame
+        self._frames.move_to_end(turn_id)
+        while len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+
+    def result(self, turn, load=None):
+        """The turn's result frame, re-running its SQL through load if it was evicted.
+
+        A failed re-run is recorded as the turn's error, so later reruns show it instead of retrying.
+        """
+        frame = self._frames.get(turn.turn_id)
+        if frame is None and turn.error is None and load is not None:
+            frame = load(turn.sql)
+            if not is_result(frame):
+                turn.error = f"Could not reload this result: {frame}"
+                return None
+            self._keep_frame(turn.turn_id, frame)
+        return frame
+
+    def figure(self, turn, load=None):
+        """The turn's figure, built at most once per turn id."""
+        if turn.turn_id not in self._figures:
+            frame = self.result(turn, load)
+            fig = None
+            if frame is not None:
+                fig = recommend_chart(chart_frame(frame))
+                if fig is None:
+                    fig = cached_chart(chart_frame(frame))
+            self._figures[turn.turn_id] = fig
+        return self._figures[turn.turn_id]
+
+    def forget_figure(self, turn):
+        self._figures.pop(turn.turn_id, None)
+
+
+def get_history():
+    """The HistoryStore of the current Streamlit session."""
+    if "history" not in st.session_state:
+        st.session_state.history = HistoryStore()
+    return st.session_state.history
+
+
+def show_row_count(result):
+    """Caption for a result that holds only part of its rows."""
+    if getattr(result, "complete", True):
+        return
+    if result.capped:
+        st.caption(f"Showing the first {len(result):,} of {result.total_rows:,} rows (result size limit reached).")
+    else:
+        st.caption(f"Showing {len(result):,} of {result.total_rows:,} rows. "
+                   "Open this question in the chat history to load more.")
+
+
+def show_chart_scope(result):
+    """Caption under a chart drawn from only part of its result."""
+    if getattr(result, "capped", False):
+        st.caption(f"Chart drawn from the first {len(result):,} of {result.total_rows:,} rows "
+                   "(result size limit reached).")
+
+
+def render_history(history, load=None, limit=MAX_RENDERED_TURNS):
+    """Chat history with each turn collapsed; results and charts are only drawn for opened turns."""
+    st.write("### Chat History")
+    for turn in reversed(history.turns[-limit:]):
+        with st.expander(f"**User:** {turn.question}", expanded=False):
+            if turn.sql:
+                st.code(turn.sql, language='sql')
+            if turn.error is not None:
+                st.error(turn.error)
+                continue
+            if not st.checkbox("Show result and chart", key=f"history-{turn.turn_id}"):
+                continue
+            frame = history.result(turn, load)
+            if frame is not None and not getattr(frame, "complete", True) and not frame.capped:
+                if st.button("Load more rows", key=f"history-more-{turn.turn_id}"):
+                    frame.load_more()
+                    history.forget_figure(turn)
+            fig = history.figure(turn, load)
+            if fig is not None:
+                st.plotly_chart(fig, key=f"history-chart-{turn.turn_id}")
+                show_chart_scope(frame)
+            if frame is not None:
+                show_row_count(frame)
+                st.dataframe(getattr(frame, "table", frame))
+            else:
+                st.info("This result is no longer available.")
+    hidden = len(history.turns) - limit
+    if hidden > 0:
+        st.caption(f"{hidden} earlier turns not shown")
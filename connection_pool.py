@@ -0,0 +1,212 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import snowflake.connector
+except ImportError:
+    snowflake = None
+
+# Pool defaults, shared by every agent running in this process
+POOL_SIZE = 4
+CHECKOUT_TIMEOUT_SECONDS = 30
+IDLE_TIMEOUT_SECONDS = 600
+MAX_LIFETIME_SECONDS = 3600
+# Connections used within this window are trusted without a round-trip ping
+HEALTH_CHECK_AFTER_SECONDS = 30
+SESSION_PARAMETERS = {"QUERY_TAG": "dbagent"}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.suspect = False
+
+
+class ConnectionPool:
+    """Bounded pool of warehouse connections that are reused across queries."""
+
+    def __init__(self, connect_params, connect=None, session_parameters=None, size=POOL_SIZE,
+                 checkout_timeout=CHECKOUT_TIMEOUT_SECONDS, idle_timeout=IDLE_TIMEOUT_SECONDS,
+                 max_lifetime=MAX_LIFETIME_SECONDS, health_check_after=HEALTH_CHECK_AFTER_SECONDS):
+        self.connect_params = dict(connect_params)
+        # Any callable with the signature of snowflake.connector.connect works,
+        # which lets a local fake connector stand in for the warehouse
+        if connect is None:
+            if snowflake is None:
+                raise RuntimeError("snowflake-connector-python is not installed; pass connect= to use another connector")
+            connect = snowflake.connector.connect
+        self._connect = connect
+        self.session_parameters = dict(SESSION_PARAMETERS if session_parameters is None else session_parameters)
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self._idle = deque()
+        self._open_count = 0
+        self._cond = threading.Condition()
+        self.stats = {"created": 0, "reused": 0, "recycled": 0, "discarded": 0}
+
+    def _open(self):
+        params = dict(self.connect_params)
+        if self.session_parameters:
+            # Session parameters are applied once at login instead of per query
+            params["session_parameters"] = self.session_parameters
+        pooled = _PooledConnection(self._connect(**params))
+        with self._cond:
+            self.stats["created"] += 1
+        return pooled
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, pooled, now):
+        return (now - pooled.last_used > self.idle_timeout
+                or now - pooled.created_at > self.max_lifetime)
+
+    def _healthy(self, pooled, now):
+        is_closed = getattr(pooled.conn, "is_closed", None)
+        if callable(is_closed) and is_closed():
+            return False
+        if not pooled.suspect and now - pooled.last_used < self.health_check_after:
+            return True
+        try:
+            cursor = pooled.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled):
+        self._close(pooled)
+        with self._cond:
+            self._open_count -= 1
+            self.stats["discarded"] += 1
+            self._cond.notify()
+
+    def _checkout(self, deadline):
+        """Pop an idle candidate, or reserve room for a new connection (None); waits while the pool is full."""
+        expired = []
+        try:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        pooled = self._idle.pop()
+                        if not self._expired(pooled, now):
+                            return pooled
+                        self._open_count -= 1
+                        self.stats["recycled"] += 1
+                        expired.append(pooled)
+                    if self._open_count < self.size:
+                        self._open_count += 1
+                        return None
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No warehouse connection available after {self.checkout_timeout}s")
+                    self._cond.wait(remaining)
+        finally:
+            for pooled in expired:
+                self._close(pooled)
+
+    def acquire(self):
+        """Check out a healthy connection, opening a new one if the pool has room."""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            pooled = self._checkout(deadline)
+            if pooled is None:
+                break
+            # The ping is a warehouse round-trip, so it runs outside the lock and
+            # never holds up other threads checking out or returning connections
+            if self._healthy(pooled, time.monotonic()):
+                with self._cond:
+                    self.stats["reused"] += 1
+                return pooled
+            self._discard(pooled)
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._open_count -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, pooled, failed=False):
+        """Return a connection to the pool; failed connections are re-checked before reuse."""
+        is_closed = getattr(pooled.conn, "is_closed", None)
+        closed = callable(is_closed) and is_closed()
+        with self._cond:
+            if closed:
+                self._open_count -= 1
+                self.stats["discarded"] += 1
+                self._cond.notify()
+                return
+            pooled.last_used = time.monotonic()
+            pooled.suspect = failed
+            self._idle.append(pooled)
+            self._cond.notify()
+        self.prune()
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled.conn
+        except Exception:
+            self.release(pooled, failed=True)
+            raise
+        else:
+            self.release(pooled)
+
+    def prune(self):
+        """Close idle connections that have passed their idle timeout or lifetime."""
+        now = time.monotonic()
+        with self._cond:
+            keep, expired = deque(), []
+            while self._idle:
+                pooled = self._idle.popleft()
+                if self._expired(pooled, now):
+                    self._open_count -= 1
+                    self.stats["recycled"] += 1
+                    expired.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+            self._cond.notify_all()
+        for pooled in expired:
+            self._close(pooled)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._open_count -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close(pooled)
+
+
+def get_pool(connect=None, session_parameters=None, **connect_params):
+    """Return the process-wide pool for these connection parameters."""
+    key = tuple(sorted((k, str(v)) for k, v in connect_params.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connect_params, connect=connect, session_parameters=session_parameters)
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,85 @@
+import re
+
+import pandas as pd
+
+from arrow_result import ArrowResult
+
+# Turns kept verbatim; older turns are rolled into a one-line summary each
+RECENT_TURNS = 3
+MAX_SUMMARY_TURNS = 10
+MAX_QUESTION_CHARS = 160
+
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.I)
+
+
+def describe_result(result):
+    """Shape and column metadata of a query result, without its rows."""
+    if isinstance(result, ArrowResult):
+        return f"Result: {len(result)} rows x {len(result.columns)} columns ({result.describe()})"
+    if isinstance(result, pd.DataFrame):
+        columns = ", ".join(f"{name} {dtype}" for name, dtype in result.dtypes.astype(str).items())
+        return f"Result: {len(result)} rows x {len(result.columns)} columns ({columns})"
+    return f"Query failed: {str(result)[:200]}"
+
+
+def result_message(result):
+    """Chat message recording a query result by its metadata instead of the full frame."""
+    return {"role": "assistant", "content": describe_result(result), "kind": "result"}
+
+
+def _content_text(message):
+    # Sessions started before results were stored as metadata may still hold frames
+    content = message["content"]
+    if isinstance(content, pd.DataFrame):
+        return describe_result(content)
+    return str(content)
+
+
+def _clip(text, limit=MAX_QUESTION_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _split_turns(messages):
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _summarize_turn(turn):
+    question = next((_content_text(m) for m in turn if m["role"] == "user"), "")
+    tables = []
+    result = None
+    for message in turn:
+        if message["role"] == "user":
+            continue
+        text = _content_text(message)
+        if message.get("kind") == "result" or isinstance(message["content"], pd.DataFrame):
+            result = text
+        else:
+            tables.extend(_TABLE_RE.findall(text))
+    parts = [f'asked "{_clip(question)}"']
+    if tables:
+        parts.append("queried " + ", ".join(dict.fromkeys(tables)))
+    if result:
+        parts.append(result)
+    return "; ".join(parts)
+
+
+def build_conversation(messages, recent_turns=RECENT_TURNS, max_summary_turns=MAX_SUMMARY_TURNS):
+    """Conversation text with the last turns verbatim and older turns summarized."""
+    turns = _split_turns(messages)
+    split = max(len(turns) - recent_turns, 0)
+    older, recent = turns[:split], turns[split:]
+    lines = []
+    if older:
+        lines.append(f"Summary of {len(older)} earlier turns:")
+        if len(older) > max_summary_turns:
+            lines.append(f"- ({len(older) - max_summary_turns} earlier questions omitted)")
+        lines.extend(f"- {_summarize_turn(turn)}" for turn in older[-max_summary_turns:])
+    for turn in recent:
+        lines.extend(f"{message['role']}: {_content_text(message)}" for message in turn)
+    return "\n".join(lines)
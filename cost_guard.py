@@ -0,0 +1,205 @@
+import json
+import os
+import re
+import threading
+
+from arrow_result import PREVIEW_ROWS
+from query_pipeline import format_bytes
+from result_cache import has_row_limit, tokenize_sql, with_limit
+from schema_retrieval import match_table
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+# Queries estimated above the warning size are rewritten where possible; above the maximum they do not run
+WARN_SCAN_BYTES = int(os.environ.get("DBAGENT_WARN_SCAN_BYTES", 10 * 1024 ** 3))
+MAX_SCAN_BYTES = int(os.environ.get("DBAGENT_MAX_SCAN_BYTES", 100 * 1024 ** 3))
+# A table counts as fully scanned when at least this share of its partitions is assigned
+FULL_SCAN_FRACTION = 0.9
+# Window of the date predicate added to fully scanned tables
+LOOKBACK_DAYS = int(os.environ.get("DBAGENT_SCAN_LOOKBACK_DAYS", 90))
+
+# Column used to bound a scan of each table, where the table has one
+DATE_COLUMNS = {
+    "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_CONTACTS": "properties_utm_current_born_on_date",
+    "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_DEALS": "properties_closedate",
+    "RUDDER_EVENTS.NURP_VIA.META_ADS_DATA_RUDDER_ADS_INSIGHTS": "DATE_START",
+    "RUDDER_EVENTS.NURP_ADS_ACCOUNT.FB_ADS_NURPRUDDER_ADS_INSIGHTS": "DATE_START",
+    "hubspot_nurp_payments.webhook_source_event": "PROPERTIES_HS_INITIATED_DATE_TIMESTAMP",
+    "schedule_once.webhook_source_event": "timestamp",
+}
+
+_AGGREGATE_WORDS = {"GROUP", "COUNT", "SUM", "AVG", "MIN", "MAX", "DISTINCT"}
+# Names after FROM/JOIN, except functions such as EXTRACT(YEAR FROM CONVERT_TIMEZONE(...))
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)\b(?!\s*\()", re.I)
+_CTE_RE = re.compile(r"(?:\bWITH|,)\s*([A-Za-z_]\w*)\s+AS\s*\(", re.I)
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+class PlanEstimate:
+    """Partitions and bytes a query is planned to read."""
+
+    def __init__(self, partitions_total, partitions_assigned, bytes_assigned):
+        self.partitions_total = partitions_total
+        self.partitions_assigned = partitions_assigned
+        self.bytes_assigned = bytes_assigned
+
+    @property
+    def full_scan(self):
+        return self.partitions_total > 0 and self.partitions_assigned >= FULL_SCAN_FRACTION * self.partitions_total
+
+    def describe(self):
+        return (f"{format_bytes(self.bytes_assigned)} across {self.partitions_assigned:,} of "
+                f"{self.partitions_total:,} partitions")
+
+
+def referenced_tables(sql):
+    """Table names a statement reads, in order of first use; CTE names are left out."""
+    ctes = {name.upper() for name in _CTE_RE.findall(sql)}
+    return [name for name in dict.fromkeys(_TABLE_RE.findall(sql)) if name.upper() not in ctes]
+
+
+def snowflake_explain(conn, sql):
+    """PlanEstimate from Snowflake's EXPLAIN USING JSON, which compiles the query without running it."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("EXPLAIN USING JSON " + sql)
+        plan = json.loads(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+    stats = plan.get("GlobalStats", {})
+    return PlanEstimate(stats.get("partitionsTotal", 0), stats.get("partitionsAssigned", 0),
+                        stats.get("bytesAssigned", 0))
+
+
+class LocalPlanner:
+    """Stand-in for EXPLAIN built from known table sizes, for running the guard without a warehouse.
+
+    table_stats maps a Schema.csv table name to (partitions, bytes). A table
+    whose date column appears after WHERE is assumed to read filtered_fraction
+    of itself.
+    """
+
+    def __init__(self, table_stats, date_columns=DATE_COLUMNS, filtered_fraction=0.1):
+        self.table_stats = table_stats
+        self.date_columns = date_columns
+        self.filtered_fraction = filtered_fraction
+
+    def explain(self, sql):
+        where = sql.upper().split("WHERE", 1)[1] if "WHERE" in sql.upper() else ""
+        total = assigned = size = 0
+        for reference in referenced_tables(sql):
+            table = match_table(reference, list(self.table_stats))
+            if table is None:
+                continue
+            partitions, table_bytes = self.table_stats[table]
+            column = self.date_columns.get(table)
+            fraction = self.filtered_fraction if column and column.upper() in where else 1.0
+            total += partitions
+            assigned += int(partitions * fraction)
+            size += int(table_bytes * fraction)
+        return PlanEstimate(total, assigned, size)
+
+
+def add_date_filter(sql, lookback_days=LOOKBACK_DAYS, date_columns=DATE_COLUMNS):
+    """sql with a recent-window predicate on each driving (FROM) table that has a date column, or None.
+
+    Joined tables are left alone: filtering the outer side of a LEFT JOIN in
+    WHERE would turn it into an inner join.
+    """
+    if sqlglot is None:
+        return None
+    try:
+        tree = sqlglot.parse_one(sql, read="snowflake")
+    except Exception:
+        return None
+    tables = list(date_columns)
+    changed = False
+    for select in tree.find_all(exp.Select):
+        # Newer sqlglot keeps the FROM clause under "from_"
+        source = select.args.get("from_") or select.args.get("from")
+        table = source.this if source is not None else None
+        if not isinstance(table, exp.Table):
+            continue
+        name = match_table(".".join(p for p in (table.catalog, table.db, table.name) if p), tables)
+        if name is None:
+            continue
+        column = date_columns[name]
+        where = select.args.get("where")
+        if where is not None and any(c.name.upper() == column.upper() for c in where.find_all(exp.Column)):
+            continue
+        condition = f"{table.alias_or_name}.{column} >= DATEADD(day, -{int(lookback_days)}, CURRENT_DATE())"
+        select.where(condition, dialect="snowflake", copy=False)
+        changed = True
+    return tree.sql(dialect="snowflake") if changed else None
+
+
+def _aggregates(sql):
+    return any(kind == "word" and text in _AGGREGATE_WORDS for kind, text in tokenize_sql(sql))
+
+
+class GuardDecision:
+    """What to do with a query: run it (possibly rewritten), with notes for the user, or reject it."""
+
+    def __init__(self, sql, estimate=None, notes=None, rejected=False):
+        self.sql = sql
+        self.estimate = estimate
+        self.notes = notes or []
+        self.rejected = rejected
+
+    def message(self):
+        return " ".join(self.notes)
+
+
+class CostGuard:
+    """Pre-flight scan-size check using an EXPLAIN-like estimate of each query."""
+
+    def __init__(self, warn_bytes=WARN_SCAN_BYTES, max_bytes=MAX_SCAN_BYTES, lookback_days=LOOKBACK_DAYS):
+        self.warn_bytes = warn_bytes
+        self.max_bytes = max_bytes
+        self.lookback_days = lookback_days
+
+    def check(self, sql, explain):
+        """Decide on sql given explain(sql) -> PlanEstimate; queries that cannot be planned run unchanged."""
+        try:
+            estimate = explain(sql)
+        except Exception:
+            # The query itself will report why it cannot compile
+            return GuardDecision(sql)
+        if estimate.bytes_assigned <= self.warn_bytes:
+            return GuardDecision(sql, estimate)
+
+        notes = [f"This query would scan {estimate.describe()}."]
+        if estimate.full_scan:
+            rewritten = add_date_filter(sql, self.lookback_days)
+            if rewritten:
+                try:
+                    narrowed = explain(rewritten)
+                except Exception:
+                    narrowed = None
+                if narrowed is not None and narrowed.bytes_assigned < estimate.bytes_assigned:
+                    sql, estimate = rewritten, narrowed
+                    notes.append(f"Limited it to the last {self.lookback_days} days ({estimate.describe()}).")
+        if estimate.bytes_assigned > self.max_bytes:
+            notes.append(f"That is over the {format_bytes(self.max_bytes)} limit, so it was not run. "
+                         "Add a date filter or narrow the joins.")
+            return GuardDecision(sql, estimate, notes, rejected=True)
+        if not _aggregates(sql) and not has_row_limit(sql):
+            # Row-level queries can stop early once enough rows are found
+            sql = with_limit(sql, PREVIEW_ROWS)
+            notes.append(f"Returning the first {PREVIEW_ROWS} rows.")
+        return GuardDecision(sql, estimate, notes)
+
+
+def get_cost_guard():
+    """Return the process-wide cost guard."""
+    global _guard
+    with _guard_lock:
+        if _guard is None:
+            _guard = CostGuard()
+        return _guard
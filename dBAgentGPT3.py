@@ -1,88 +1,92 @@
-import pandas as pd
 import openai
 import streamlit as st
 import os
-import snowflake.connector
-import plotly.express as px
-import tiktoken
+from query_pipeline import QUERY_TIMEOUT_SECONDS, bare_sql_statement_end, start_query
+from arrow_result import PREVIEW_ROWS, ArrowResult, chart_frame
+from result_cache import get_result_cache, with_limit
+from conversation_memory import build_conversation, result_message
+from llm_stream import stream_chat_completion
+from prompt_context import count_tokens, get_schema_block, get_examples_block
+from prompt_budget import PromptSection, fit_prompt
+from data_profile import profile_dataframe
+from chart_engine import cached_chart, chart_ready, recommend_chart, run_chart_code
+from chat_history import get_history, render_history, show_chart_scope, show_row_count
+from schema_retrieval import relevant_schema_info
+from sql_repair import repair_query
+from warehouse import execute_checked, get_backend
+from extract_cache import local_first
 import re
-from plotly.subplots import make_subplots
-import plotly.graph_objs as go
 from openai import OpenAI
 
 # Ensure session state is initialized at the very beginning
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 
-# Check and prompt for Snowflake credentials
-SNOWFLAKE_PASSWORD = st.secrets.credentials.sf_password
-
-SNOWFLAKE_USER = "Rahul"
-SNOWFLAKE_ACCOUNT = "zt30947.us-east-2.aws"
-SNOWFLAKE_WAREHOUSE = "RUDDER_WAREHOUSE"
-SNOWFLAKE_DATABASE = "RUDDER_EVENTS"
-SNOWFLAKE_ROLE = "Rudder"
-
 # Access the API key from Streamlit secrets and initialize the client
 api_key = st.secrets.credentials.api_key
 client = OpenAI(api_key=api_key)
 
-def execute_query(query):
-    try:
-        conn = snowflake.connector.connect(
-            user=SNOWFLAKE_USER,
-            password=SNOWFLAKE_PASSWORD,
-            account=SNOWFLAKE_ACCOUNT,
-            warehouse=SNOWFLAKE_WAREHOUSE,
-            database=SNOWFLAKE_DATABASE,
-            role=SNOWFLAKE_ROLE
-        )
-        cursor = conn.cursor()
-        cursor.execute(query)
-        result = cursor.fetch_pandas_all()
-        cursor.close()
-        conn.close()
-        return result
-    except Exception as e:
-        return str(e)
+# This agent's Snowflake account, unless DBAGENT_SNOWFLAKE_* or the [snowflake] secrets say otherwise
+SNOWFLAKE_DEFAULTS = {
+    "user": "Rahul",
+    "account": "zt30947.us-east-2.aws",
+    "warehouse": "RUDDER_WAREHOUSE",
+    "database": "RUDDER_EVENTS",
+    "role": "Rudder",
+}
+
+def get_warehouse():
+    # Backend comes from DBAGENT_BACKEND and the account from SNOWFLAKE_DEFAULTS and the Streamlit secrets;
+    # queries on the hot tables are answered from fresh local extracts when there are any
+    return local_first(get_backend(settings=st.secrets, snowflake_defaults=SNOWFLAKE_DEFAULTS))
+
+def execute_query(query, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+    return execute_checked(get_warehouse(), query, progress, warn=st.warning, timeout=timeout)
+
+def describe_query(query):
+    # Column names and types from the warehouse's compile step, without running the query
+    return get_warehouse().describe(query)
 
 def generate_sql(conversation):
+    system_prompt = "You are an expert SQL query writer for Snowflake databases. Use the provided schema and examples to generate accurate SQL queries. Make sure to use the exact table and column names from the schema."
+
+    # Fit schema and conversation into the model's context budget, trimming older conversation first
+    sections = fit_prompt("ft:gpt-3.5-turbo-0125:cubestack-solutions::9Zg408OA", [
+        PromptSection("schema", schema_info, priority=2),
+        PromptSection("conversation", conversation, priority=1, keep="tail"),
+    ], fixed_text=system_prompt, max_output_tokens=1000)
+
     prompt = f"""
     Generate an SQL query based on the given conversation, schema, and examples. Follow the schema strictly and use the logic and filters from the examples provided as a information base to the data, and refer it. Also use it to figure out which column to use on what queries, and those columns are present in table schema. Use identifiers in query very carefully.
 
     Schema:
-    {schema_info}
+    {sections['schema']}
 
     # Examples:
     # examples
 
     Conversation:
-    {conversation}
+    {sections['conversation']}
 
     Generated SQL Query:
     """
 
     full_prompt = [
-        {"role": "system", "content": "You are an expert SQL query writer for Snowflake databases. Use the provided schema and examples to generate accurate SQL queries. Make sure to use the exact table and column names from the schema."},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
     ]
 
-    enc = tiktoken.get_encoding("cl100k_base")
-    token_count = sum([len(enc.encode(message["content"])) for message in full_prompt])
+    token_count = sum([count_tokens(message["content"]) for message in full_prompt])
     st.write(f"Token count: {token_count}")
 
     try:
-        stream = client.chat.completions.create(
+        sql_query = stream_chat_completion(
+            client,
+            placeholder=st.empty(),
+            stop_at=bare_sql_statement_end,
             model="ft:gpt-3.5-turbo-0125:cubestack-solutions::9Zg408OA",
             messages=full_prompt,
-            stream=True,
         )
-
-        sql_query = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                sql_query += chunk.choices[0].delta.content
-                #st.write(chunk.choices[0].delta.content)  # Displaying the stream content in real-time in Streamlit
         return sql_query.strip()
     except Exception as e:
         st.error(f"Error generating SQL: {e}")
@@ -95,37 +99,40 @@ def extract_query_from_message(content):
         return match.group(1).strip()
     return content
 
-def handle_error(query, error):
+def handle_error(query, error, conversation):
+    system_prompt = "You are an expert SQL query writer for Snowflake databases. Resolve SQL errors using the provided schema and conversation context. "
+    sections = fit_prompt("ft:gpt-3.5-turbo-0125:cubestack-solutions::9Zg408OA", [
+        PromptSection("error", error, priority=2),
+        PromptSection("query", query, priority=3),
+        PromptSection("conversation", conversation, priority=1, keep="tail"),
+    ], fixed_text=system_prompt, max_output_tokens=1000)
+
     prompt = f"""
     Resolve the following SQL error for the given query based on the provided schema and conversation.
 
     Error:
-    {error}
+    {sections['error']}
 
     Code:
-    {query}
+    {sections['query']}
 
     Conversation:
-    {conversation}
+    {sections['conversation']}
 
     Corrected SQL Query:
     """
     
     try:
-        stream = client.chat.completions.create(
+        corrected_sql_query = stream_chat_completion(
+            client,
+            placeholder=st.empty(),
+            stop_at=bare_sql_statement_end,
             model="ft:gpt-3.5-turbo-0125:cubestack-solutions::9Zg408OA",
             messages=[
-                {"role": "system", "content": "You are an expert SQL query writer for Snowflake databases. Resolve SQL errors using the provided schema and conversation context. "},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            stream=True,
         )
-        
-        corrected_sql_query = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                corrected_sql_query += chunk.choices[0].delta.content
-                #st.write(chunk.choices[0].delta.content)  # Displaying the stream content in real-time in Streamlit
         return corrected_sql_query.strip()
     except Exception as e:
         st.error(f"Error correcting SQL: {e}")
@@ -136,20 +143,26 @@ def generate_chart_code(dataframe):
         st.error("Invalid dataframe provided to generate_chart_code.")
         return ""
 
+    system_prompt = "You are an expert in data visualization using Plotly. Use the given DataFrame, identify x axis and y axis properly. you can give multiple charts if one is not enough for the data. generate professional and appealing chart code. The DataFrame will be provided as 'df'."
+    sections = fit_prompt("gpt-4", [
+        PromptSection("data", profile_dataframe(dataframe), priority=1),
+    ], fixed_text=system_prompt, max_output_tokens=4000)
+
     prompt = f"""
 You are an expert in data visualization. Given a pandas DataFrame with the following columns: {', '.join(dataframe.columns)}, generate the best charting code using Plotly. The code should produce an informative and visually appealing chart.
 
-Data to be plotted:
-{dataframe.head().to_string(index=False)}
+Data profile:
+{sections['data']}
 """
 
     full_prompt = [
-        {"role": "system", "content": "You are an expert in data visualization using Plotly. Use the given DataFrame, identify x axis and y axis properly. you can give multiple charts if one is not enough for the data. generate professional and appealing chart code. The DataFrame will be provided as 'df'."},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
     ]
 
     try:
-        response = openai.chat.completions.create(
+        response = stream_chat_completion(
+            openai,
             model="gpt-4",
             messages=full_prompt,
             max_tokens=4000,
@@ -157,7 +170,7 @@ Data to be plotted:
             n=1,
             stop=None
         )
-        chart_code_response = response.choices[0].message.content
+        chart_code_response = response
         return chart_code_response
     except Exception as e:
         st.error(f"Error generating chart code: {e}")
@@ -172,81 +185,85 @@ def extract_code_from_response(response):
     return ""
 
 if api_key:
-    schema_file_path = 'Schema.csv'
-    schema_df = pd.read_csv(schema_file_path)
-
-    examples_file_path = 'Examples.csv'
-    examples_df = pd.read_csv(examples_file_path)
-
-    schema_info = ""
-    for _, row in schema_df.iterrows():
-        schema_info += f"Table: {row['Table Name']}\nColumn: {row['Column Name']}\nDescription: {row['Column Description']}\n\n"
-
-    examples = ""
-    for _, row in examples_df.iterrows():
-        examples += f"Question: {row['Question']}\nQuery: {row['Query']}\n\n"
+    # Schema and example prompt blocks are built once per process and reused across reruns
+    schema_info = get_schema_block().text
+    examples = get_examples_block().text
 
     st.title("BI Automation")
 
     user_question = st.text_input("Define your Marketing Analytics Requirements:")
+    preview = st.checkbox(f"Preview run (first {PREVIEW_ROWS} rows only)")
 
     if st.button("Send"):
         if user_question:
-            conversation = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
+            # Send only the tables and columns relevant to this question
+            schema_info = relevant_schema_info(user_question)
+            conversation = build_conversation(st.session_state.messages)
             sql_query = generate_sql(conversation + f"\nUser: {user_question}")
             st.session_state.messages.append({"role": "user", "content": user_question})
             st.session_state.messages.append({"role": "assistant", "content": sql_query})
             actual_sql_query = extract_query_from_message(sql_query)
+            if preview:
+                actual_sql_query = with_limit(actual_sql_query, PREVIEW_ROWS)
 
-            result = execute_query(actual_sql_query)
+            # Run the query in the background and draft chart code from its columns meanwhile
+            pending = start_query(actual_sql_query, execute_query, describe_query, generate_chart_code,
+                                  skip_chart=chart_ready)
+            # Shows elapsed time and bytes scanned; stopping or re-asking cancels the query
+            result = pending.wait(st.empty())
 
-            if isinstance(result, str) and "SQL compilation error" in result:
+            if isinstance(result, str):
                 st.error(f"SQL compilation error: {result}")
-                corrected_sql_query = handle_error(actual_sql_query, result)
-                st.session_state.messages.append({"role": "assistant", "content": corrected_sql_query})
-                corrected_sql_query_text = extract_query_from_message(corrected_sql_query)
-                result = execute_query(corrected_sql_query_text)
-                if isinstance(result, str) and "SQL compilation error" in result:
+                # Correct and re-run with structured error feedback, within an attempt and time budget
+                repair = repair_query(
+                    actual_sql_query, result,
+                    fix=lambda sql, feedback: extract_query_from_message(handle_error(sql, feedback, conversation)),
+                    execute=execute_query,
+                )
+                st.caption(repair.summary())
+                corrected_sql_query_text = repair.sql
+                result = repair.result
+                if not repair.succeeded:
                     st.error(f"Error executing corrected query: {result}")
+                    get_history().add(user_question, corrected_sql_query_text, result)
                 else:
                     st.write("### Corrected Query Result")
-                    st.write(result)
+                    show_row_count(result)
+                    st.dataframe(result.table)
                     st.session_state.messages.append({"role": "assistant", "content": corrected_sql_query_text})
+                    get_history().add(user_question, corrected_sql_query_text, result)
             else:
                 st.write("### Query Result")
-                st.session_state.messages.append({"role": "assistant", "content": result})
+                show_row_count(result)
+                st.session_state.messages.append(result_message(result))
 
-                if not isinstance(result, pd.DataFrame):
+                if not isinstance(result, ArrowResult):
                     st.error("Result is not a valid DataFrame.")
+                    get_history().add(user_question, actual_sql_query, result)
                 else:
-                    chart_code_response = generate_chart_code(result)
-                    st.write("### Chart Code Response")
-                    chart_code = extract_code_from_response(chart_code_response)
-                    try:
-                        # Define the local scope for exec to capture the figure
-                        local_scope = {}
-                        exec(chart_code, {'pd': pd, 'px': px, 'go': go, 'make_subplots': make_subplots, 'df': result}, local_scope)
-                        fig = local_scope.get('fig')
-                        if fig:
-                            st.plotly_chart(fig)
-                        else:
-                            st.error("No figure found in the generated code.")
-                    except Exception as e:
-                        st.error(f"Error executing chart code: {e}")
-
-    st.write("### Chat History")
-    for message in reversed(st.session_state.messages):
-        if message['role'] == 'user':
-            st.write(f"**User:** {message['content']}")
-        else:
-            try:
-                if isinstance(result, pd.DataFrame):
-                    fig = px.line(result)
-                    st.plotly_chart(fig)
-            except:
-                print("Something is suspicious")
-            st.code(message['content'], language='sql')
-            if isinstance(result, pd.DataFrame):
-                st.write(result)
+                    st.dataframe(result.table)
+                    # Common result shapes and previously seen columns are charted without asking the model
+                    fig = recommend_chart(chart_frame(result))
+                    if fig is None:
+                        fig = cached_chart(chart_frame(result))
+                    if fig is None:
+                        chart_code_response = pending.chart_code(chart_frame(result))
+                        st.write("### Chart Code Response")
+                        chart_code = extract_code_from_response(chart_code_response)
+                        try:
+                            fig = run_chart_code(chart_code, chart_frame(result))
+                            if fig is None:
+                                st.error("No figure found in the generated code.")
+                        except Exception as e:
+                            st.error(f"Error executing chart code: {e}")
+                    if fig is not None:
+                        st.plotly_chart(fig)
+                        show_chart_scope(result)
+                    get_history().add(user_question, actual_sql_query, result, fig)
+
+    # Past turns come from the history store and stay collapsed until opened
+    render_history(get_history(), load=execute_query)
+    cache_stats = get_result_cache().stats()
+    st.sidebar.caption(f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
 else:
     st.warning("Please enter your OpenAI API key to proceed.")
@@ -0,0 +1,117 @@
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_ROWS = 12
+TOP_VALUES = 5
+# Categorical columns with at most this many values are used to stratify the sample
+STRATIFY_MAX_CARDINALITY = 20
+# Integer columns named like identifiers (ID, CLICKFUNNEL_ID, DEAL_KEY) are dimensions, not metrics
+ID_COLUMN_PATTERN = re.compile(r"(^|_)(ID|KEY)$", re.IGNORECASE)
+
+_GRANULARITIES = [
+    (pd.Timedelta(minutes=1), "minute"),
+    (pd.Timedelta(hours=1), "hourly"),
+    (pd.Timedelta(days=1), "daily"),
+    (pd.Timedelta(days=7), "weekly"),
+    (pd.Timedelta(days=31), "monthly"),
+    (pd.Timedelta(days=92), "quarterly"),
+]
+
+
+def as_datetime(series):
+    """The series as datetimes when it holds dates, otherwise None."""
+    # Snowflake DATE columns arrive as Python date objects in an object column
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if series.dtype == object:
+        first = series.dropna().head(1)
+        if len(first) and isinstance(first.iloc[0], (datetime.date, datetime.datetime)):
+            return pd.to_datetime(series, errors="coerce")
+    return None
+
+
+def column_roles(df):
+    """Split columns into date, dimension and metric columns by dtype and, for integer IDs, by name."""
+    dates, dimensions, metrics = [], [], []
+    for name in df.columns:
+        series = df[name]
+        if pd.api.types.is_bool_dtype(series):
+            dimensions.append(name)
+        elif pd.api.types.is_integer_dtype(series) and ID_COLUMN_PATTERN.search(str(name)):
+            dimensions.append(name)
+        elif pd.api.types.is_numeric_dtype(series):
+            metrics.append(name)
+        elif as_datetime(series) is not None:
+            dates.append(name)
+        else:
+            dimensions.append(name)
+    return dates, dimensions, metrics
+
+
+def time_granularity(series):
+    """Guess the spacing of a datetime column from the median gap between distinct values."""
+    values = series.dropna().drop_duplicates().sort_values()
+    if len(values) < 2:
+        return "single point"
+    gap = values.diff().median()
+    for limit, name in _GRANULARITIES:
+        if gap <= limit:
+            return name
+    return "yearly"
+
+
+def stratified_sample(df, rows=SAMPLE_ROWS):
+    """A few rows that cover the low-cardinality categories, or evenly spaced rows otherwise."""
+    if len(df) <= rows:
+        return df
+    categorical = [c for c in df.columns
+                   if not pd.api.types.is_numeric_dtype(df[c]) and df[c].nunique() <= STRATIFY_MAX_CARDINALITY]
+    if categorical:
+        column = min(categorical, key=lambda c: df[c].nunique())
+        per_group = max(1, rows // max(df[column].nunique(), 1))
+        sample = df.groupby(column, dropna=False, sort=False).head(per_group)
+        if len(sample) >= rows // 2:
+            return sample.head(rows)
+    return df.iloc[np.linspace(0, len(df) - 1, rows).astype(int)]
+
+
+def _format(value):
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def profile_dataframe(df):
+    """Compact description of a result for the chart prompt, independent of its row count."""
+    lines = [f"The full DataFrame is available as `df`. Rows: {len(df)}, columns: {len(df.columns)}"]
+    if len(df) == 0:
+        lines.append("Columns (rows not fetched yet):")
+        lines.extend(f"- {name}: {dtype}" for name, dtype in df.dtypes.astype(str).items())
+        return "\n".join(lines)
+
+    cardinality = df.nunique(dropna=True)
+    numeric = df.select_dtypes(include="number")
+    quantiles = numeric.quantile([0.25, 0.5, 0.75]) if len(numeric.columns) else None
+    lines.append("Columns:")
+    for name in df.columns:
+        series = df[name]
+        parts = [f"{series.dtype}", f"{cardinality[name]} distinct"]
+        nulls = int(series.isna().sum())
+        if nulls:
+            parts.append(f"{nulls} null")
+        dates = as_datetime(series)
+        if name in numeric.columns:
+            parts.append(f"min {_format(series.min())}, max {_format(series.max())}")
+            parts.append("p25/p50/p75 " + "/".join(_format(v) for v in quantiles[name]))
+        elif dates is not None:
+            parts.append(f"from {dates.min()} to {dates.max()}, granularity {time_granularity(dates)}")
+        else:
+            top = series.value_counts().head(TOP_VALUES)
+            parts.append("top values " + ", ".join(f"{_format(v)} ({n})" for v, n in top.items()))
+        lines.append(f"- {name}: " + ", ".join(parts))
+    lines.append("Sample rows:")
+    lines.append(stratified_sample(df).to_string(index=False, max_colwidth=40))
+    return "\n".join(lines)
@@ -2,73 +2,79 @@ import pandas as pd
 import openai
 import streamlit as st
 import os
-import snowflake.connector
-import plotly.express as px
-import tiktoken
+from query_pipeline import QUERY_TIMEOUT_SECONDS, sql_statement_end, start_query
+from arrow_result import PREVIEW_ROWS, ArrowResult, chart_frame
+from result_cache import get_result_cache, with_limit
+from conversation_memory import build_conversation, result_message
+from llm_stream import stream_chat_completion
+from prompt_context import count_tokens, get_schema_block, get_examples_block
+from prompt_budget import PromptSection, fit_prompt
+from data_profile import profile_dataframe
+from chart_engine import cached_chart, chart_ready, recommend_chart, run_chart_code
+from chat_history import get_history, render_history, show_chart_scope, show_row_count
+from schema_retrieval import relevant_schema_info
+from example_selection import relevant_examples
+from sql_repair import repair_query
+from warehouse import execute_checked, get_backend
+from extract_cache import local_first
 import re
-from plotly.subplots import make_subplots
-import plotly.graph_objs as go
 # Ensure session state is initialized at the very beginning
 if 'messages' not in st.session_state:
     st.session_state.messages = []
-# Check and prompt for Snowflake credentials
-SNOWFLAKE_PASSWORD = st.secrets.credentials.sf_password
-print(st.secrets.credentials.sf_password)
-#Put user and account in ST environment
-
-SNOWFLAKE_USER = "DATAINTEGRITY_KALIPER"
-#SNOWFLAKE_ACCOUNT = "zt30947.us-east-2.aws.snowflakecomputing.com"
-SNOWFLAKE_ACCOUNT = "jsgkebp-cn71497"
-SNOWFLAKE_DATABASE = "RUDDER_EVENTS"
-SNOWFLAKE_WAREHOUSE = "RUDDER_WAREHOUSE"
-SNOWFLAKE_ROLE = "RUDDER"
 openai.api_key = st.secrets.credentials.api_key
-def execute_query(query):
-    try:
-        conn = snowflake.connector.connect(
-            user=SNOWFLAKE_USER,
-            password=SNOWFLAKE_PASSWORD,
-            account=SNOWFLAKE_ACCOUNT,
-            database = SNOWFLAKE_DATABASE,
-            warehouse=SNOWFLAKE_WAREHOUSE,
-            role=SNOWFLAKE_ROLE,
-        )
-        cursor = conn.cursor()
-        cursor.execute(query)
-        result = cursor.fetch_pandas_all()
-        cursor.close()
-        conn.close()
-        return result
-    except Exception as e:
-        return str(e)
+# This agent's Snowflake account, unless DBAGENT_SNOWFLAKE_* or the [snowflake] secrets say otherwise
+SNOWFLAKE_DEFAULTS = {
+    "user": "DATAINTEGRITY_KALIPER",
+    "account": "jsgkebp-cn71497",
+    "database": "RUDDER_EVENTS",
+    "warehouse": "RUDDER_WAREHOUSE",
+    "role": "RUDDER",
+}
+
+def get_warehouse():
+    # Backend comes from DBAGENT_BACKEND and the account from SNOWFLAKE_DEFAULTS and the Streamlit secrets;
+    # queries on the hot tables are answered from fresh local extracts when there are any
+    return local_first(get_backend(settings=st.secrets, snowflake_defaults=SNOWFLAKE_DEFAULTS))
+
+def execute_query(query, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+    return execute_checked(get_warehouse(), query, progress, warn=st.warning, timeout=timeout)
+
+def describe_query(query):
+    # Column names and types from the warehouse's compile step, without running the query
+    return get_warehouse().describe(query)
+
 def generate_sql(conversation):
+    system_prompt = "You are a Snowflake Expert that generates SQL queries. Use Snowflake processing standards. These queries should follow format from examples and Schema file. Query should not be out of schema provided, this is most crucial, especially make sure of schema when you are giving join statements with ON clause, and filters. Dont Assume.  Also add 'Generated SQL Query:' term just before sql query to identify, don't add any other identifier, apart from text 'Generated SQL Query:', and don't write anything after the query ends."
+    # Fit schema, examples and conversation into the model's context budget, trimming examples first
+    sections = fit_prompt("gpt-4o", [
+        PromptSection("schema", schema_info, priority=3),
+        PromptSection("examples", examples, priority=1),
+        PromptSection("conversation", conversation, priority=2, keep="tail"),
+    ], fixed_text=system_prompt, max_output_tokens=4000)
     prompt = f"""
     You are an expert SQL query writer. Given the following schema and examples, generate a SQL query for the given question. Be mindful of the following: 1. The query should only contain tables and columns combinations as per the schema. For help in generating the query, refer to the examples. If there is no schema passed. Display message that no schema available for this query.
     Schema:
-    {schema_info}
+    {sections['schema']}
     Examples:
-    {examples}
+    {sections['examples']}
     Conversation:
-    {conversation}
+    {sections['conversation']}
     """
     full_prompt = [
-        {"role": "system", "content": "You are a Snowflake Expert that generates SQL queries. Use Snowflake processing standards. These queries should follow format from examples and Schema file. Query should not be out of schema provided, this is most crucial, especially make sure of schema when you are giving join statements with ON clause, and filters. Dont Assume.  Also add 'Generated SQL Query:' term just before sql query to identify, don't add any other identifier, apart from text 'Generated SQL Query:', and don't write anything after the query ends."},
+        {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
     ]
-    # Tokenizer
-    enc = tiktoken.get_encoding("cl100k_base")
     # Calculate token count for each message
-    token_count = sum([len(enc.encode(message["content"])) for message in full_prompt])
+    token_count = sum([count_tokens(message["content"]) for message in full_prompt])
     st.write(token_count)
     # Print token count and full prompt for debugging
     print(f"Total token count: {token_count}")
     print("Full prompt being sent:")
     #st.write(full_prompt)
-    
-    # # Ensure token count is within the model's limit
-    # if token_count > 4096:  # Adjust based on model's token limit (e.g., 4096 for GPT-4)
-    #     raise ValueError("Prompt is too long and exceeds the token limit for the model.")
-    response = openai.chat.completions.create(
+    response = stream_chat_completion(
+        openai,
+        placeholder=st.empty(),
+        stop_at=sql_statement_end,
         model="gpt-4o",
         messages=full_prompt,
         max_tokens=4000,
@@ -76,21 +82,30 @@ def generate_sql(conversation):
         n=1,
         stop=None
     )
-    return response.choices[0].message.content.strip()
-def handle_error(query, error):
+    return response.strip()
+def handle_error(query, error, conversation):
+    system_prompt = "You are a Snowflake Expert that generates SQL queries. Use Snowflake processing standards. Also add 'Generated SQL Query:' term just before sql query to identify, don't add any other identifier like 'sql' or '`' in response, apart from text 'Generated SQL Query:' and don't write anything after the query ends."
+    sections = fit_prompt("gpt-4o", [
+        PromptSection("error", error, priority=2),
+        PromptSection("query", query, priority=3),
+        PromptSection("conversation", conversation, priority=1, keep="tail"),
+    ], fixed_text=system_prompt, max_output_tokens=4000)
     prompt = f"""
     Given the following SQL, and the error from Snowflake, along with user conversation. Resolve this. Also add 'Generated SQL Query:' term just before sql query to identify, don't add any other identifier like 'sql' or '`' in response
     Error:
-    {error}
+    {sections['error']}
     Code:
-    {query}
+    {sections['query']}
     Conversation:
-    {conversation}
+    {sections['conversation']}
     """
-    response = openai.chat.completions.create(
+    response = stream_chat_completion(
+        openai,
+        placeholder=st.empty(),
+        stop_at=sql_statement_end,
         model="gpt-4o",
         messages=[
-            {"role": "system", "content": "You are a Snowflake Expert that generates SQL queries. Use Snowflake processing standards. Also add 'Generated SQL Query:' term just before sql query to identify, don't add any other identifier like 'sql' or '`' in response, apart from text 'Generated SQL Query:' and don't write anything after the query ends."},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ],
         max_tokens=4000,
@@ -98,7 +113,7 @@ def handle_error(query, error):
         n=1,
         stop=None
     )
-    return response.choices[0].message.content.strip()
+    return response.strip()
 def extract_query_from_message(content):
     if "Generated SQL Query:" in content:
         query_part = content.split("Generated SQL Query:", 1)[1].strip()
@@ -115,17 +130,21 @@ def extract_query_from_message(content):
 def generate_chart_code(dataframe):
     if isinstance(dataframe, pd.DataFrame):
         columns_list = ', '.join(dataframe.columns)
-        dataframe_str = dataframe.to_string()
+        system_prompt = "You are an expert in data visualization using Plotly. Brand colour is purple, use majorly white and purple shades. give proper visible dark legends, title, and data axis for white background. Make a 3D looking chart in 2D, that looks professional and super appealing. use valid hex color code as color id in code. Start python code with string '```python' and end with '```'"
+        sections = fit_prompt("gpt-4o", [
+            PromptSection("data", profile_dataframe(dataframe), priority=1),
+        ], fixed_text=system_prompt, max_output_tokens=4000)
         prompt = f"""
         You are an expert in data visualization. Given a pandas DataFrame with the following columns: {columns_list}, generate the best charting code using Plotly. The code should produce an informative and visually appealing chart.
-        Data to be plotted:
-        {dataframe_str}
+        Data profile:
+        {sections['data']}
         """
         full_prompt = [
-            {"role": "system", "content": "You are an expert in data visualization using Plotly. Brand colour is purple, use majorly white and purple shades. give proper visible dark legends, title, and data axis for white background. Make a 3D looking chart in 2D, that looks professional and super appealing. use valid hex color code as color id in code. Start python code with string '```python' and end with '```'"},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ]
-        response = openai.chat.completions.create(
+        response = stream_chat_completion(
+            openai,
             model="gpt-4o",
             messages=full_prompt,
             max_tokens=4000,
@@ -133,7 +152,7 @@ def generate_chart_code(dataframe):
             n=1,
             stop=None
         )
-        return response.choices[0].message.content.strip()
+        return response.strip()
     else:
         raise ValueError("The input is not a valid pandas DataFrame")
 def extract_code_from_response(response):
@@ -143,99 +162,100 @@ def extract_code_from_response(response):
         return code_block.group(1).strip()
     return ""
 if openai.api_key:
-    # Load schema CSV
-    schema_file_path = 'Schema.csv'
-    schema_df = pd.read_csv(schema_file_path)
-    # Load examples CSV
-    examples_file_path = 'Examples.csv'
-    examples_df = pd.read_csv(examples_file_path)
-    # Prepare schema information
-    schema_info = ""
-    for _, row in schema_df.iterrows():
-        schema_info += f"Table: {row['Table Name']}\nColumn: {row['Column Name']}\nDescription: {row['Column Description']}\n\n"
-    # Prepare examples
-    examples = ""
-    for _, row in examples_df.iterrows():
-        examples += f"Question: {row['Question']}\nQuery: {row['Query']}\n\n"
+    # Schema and example prompt blocks are built once per process and reused across reruns
+    schema_info = get_schema_block().text
+    examples = get_examples_block().text
     
     st.title("BI Automation")
     # Streamlit interface
     user_question = st.text_input("Define your Marketing Analytics Requirements:")
+    preview = st.checkbox(f"Preview run (first {PREVIEW_ROWS} rows only)")
     if st.button("Send"):
         if user_question:
-            conversation = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
+            # Send only the tables, columns and examples relevant to this question
+            schema_info = relevant_schema_info(user_question)
+            examples = relevant_examples(user_question)
+            conversation = build_conversation(st.session_state.messages)
             sql_query = generate_sql(conversation + f"\nUser: {user_question}")
             st.session_state.messages.append({"role": "user", "content": user_question})
             st.session_state.messages.append({"role": "assistant", "content": sql_query})
             actual_sql_query = extract_query_from_message(sql_query)
+            if preview:
+                actual_sql_query = with_limit(actual_sql_query, PREVIEW_ROWS)
             
-            result = execute_query(actual_sql_query)
+            # Run the query in the background and draft chart code from its columns meanwhile
+            pending = start_query(actual_sql_query, execute_query, describe_query, generate_chart_code,
+                                  skip_chart=chart_ready)
+            # Shows elapsed time and bytes scanned; stopping or re-asking cancels the query
+            result = pending.wait(st.empty())
             
-            if isinstance(result, pd.DataFrame):
+            if isinstance(result, ArrowResult):
                 st.write("### Query Result")
-                st.write(result)
-                st.session_state.messages.append({"role": "assistant", "content": result})
+                show_row_count(result)
+                st.dataframe(result.table)
+                st.session_state.messages.append(result_message(result))
                 
                 # Generate and display the chart
-                chart_code_response = generate_chart_code(result)
-                st.write("### Chart Code Response")
-                chart_code = extract_code_from_response(chart_code_response)
-                #st.code(chart_code, language='python')
-                
-                try:
-                    # Define the local scope for exec to capture the figure
-                    local_scope = {}
-                    exec(chart_code, {'pd': pd, 'px': px, 'go': go, 'make_subplots': make_subplots, 'df': result}, local_scope)
-                    fig = local_scope.get('fig')
-                    if fig:
-                        st.plotly_chart(fig)
-                    else:
-                        st.error("No figure found in the generated code.")
-                except Exception as e:
-                    st.error(f"Error executing chart code: {e}")
-            else:
-                st.error(f"SQL compilation error: {result}")
-                corrected_sql_query = handle_error(actual_sql_query, result)
-                st.session_state.messages.append({"role": "assistant", "content": corrected_sql_query})
-                corrected_sql_query_text = extract_query_from_message(corrected_sql_query)
-                result = execute_query(corrected_sql_query_text)
-                if isinstance(result, pd.DataFrame):
-                    st.write("### Corrected Query Result")
-                    st.write(result)
-                    st.session_state.messages.append({"role": "assistant", "content": corrected_sql_query_text})
-                    
-                    # Generate and display the chart
-                    chart_code_response = generate_chart_code(result)
+                # Common result shapes and previously seen columns are charted without asking the model
+                fig = recommend_chart(chart_frame(result))
+                if fig is None:
+                    fig = cached_chart(chart_frame(result))
+                if fig is None:
+                    chart_code_response = pending.chart_code(chart_frame(result))
                     st.write("### Chart Code Response")
                     chart_code = extract_code_from_response(chart_code_response)
-                    #st.code(chart_code, language='python')
-                    
                     try:
-                        # Define the local scope for exec to capture the figure
-                        local_scope = {}
-                        exec(chart_code, {'pd': pd, 'px': px, 'go': go, 'make_subplots': make_subplots, 'df': result}, local_scope)
-                        fig = local_scope.get('fig')
-                        if fig:
-                            st.plotly_chart(fig)
-                        else:
+                        fig = run_chart_code(chart_code, chart_frame(result))
+                        if fig is None:
                             st.error("No figure found in the generated code.")
                     except Exception as e:
                         st.error(f"Error executing chart code: {e}")
+                if fig is not None:
+                    st.plotly_chart(fig)
+                    show_chart_scope(result)
+                get_history().add(user_question, actual_sql_query, result, fig)
+            else:
+                st.error(f"SQL compilation error: {result}")
+                # Correct and re-run with structured error feedback, within an attempt and time budget
+                repair = repair_query(
+                    actual_sql_query, result,
+                    fix=lambda sql, feedback: extract_query_from_message(handle_error(sql, feedback, conversation)),
+                    execute=execute_query,
+                )
+                st.caption(repair.summary())
+                corrected_sql_query_text = repair.sql
+                result = repair.result
+                if isinstance(result, ArrowResult):
+                    st.write("### Corrected Query Result")
+                    show_row_count(result)
+                    st.dataframe(result.table)
+                    st.session_state.messages.append({"role": "assistant", "content": corrected_sql_query_text})
+                    
+                    # Generate and display the chart
+                    # Common result shapes and previously seen columns are charted without asking the model
+                    fig = recommend_chart(chart_frame(result))
+                    if fig is None:
+                        fig = cached_chart(chart_frame(result))
+                    if fig is None:
+                        chart_code_response = generate_chart_code(chart_frame(result))
+                        st.write("### Chart Code Response")
+                        chart_code = extract_code_from_response(chart_code_response)
+                        try:
+                            fig = run_chart_code(chart_code, chart_frame(result))
+                            if fig is None:
+                                st.error("No figure found in the generated code.")
+                        except Exception as e:
+                            st.error(f"Error executing chart code: {e}")
+                    if fig is not None:
+                        st.plotly_chart(fig)
+                        show_chart_scope(result)
+                    get_history().add(user_question, corrected_sql_query_text, result, fig)
                 else:
                     st.error(f"Error executing corrected query: {result}")
-    # Display chat history
-    st.write("### Chat History")
-    for message in reversed(st.session_state.messages):
-        if message['role'] == 'user':
-            st.write(f"**User:** {message['content']}")
-        else:
-            st.write(f"**Assistant:**")
-            try:
-                fig = px.line(result)  # Example chart, customize based on your data
-                st.plotly_chart(fig)
-            except:
-                st.write("...")
-            st.code(message['content'], language='sql')
-            st.write(result)
+                    get_history().add(user_question, corrected_sql_query_text, result)
+    # Past turns come from the history store and stay collapsed until opened
+    render_history(get_history(), load=execute_query)
+    cache_stats = get_result_cache().stats()
+    st.sidebar.caption(f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
 else:
     st.warning(f"Please enter your OpenAI API key to proceed.")
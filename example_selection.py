@@ -0,0 +1,59 @@
+import threading
+
+from prompt_context import count_tokens, format_examples, get_examples_block
+from text_index import BM25Index, tokenize
+
+TOP_K_EXAMPLES = 3
+EXAMPLES_TOKEN_BUDGET = 2500
+
+# Per-text caches, so a change to Examples.csv only re-tokenizes the rows that changed
+_question_tokens = {}
+_entry_tokens = {}
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class ExampleIndex:
+    """BM25 index over the example questions used to pick few-shot examples."""
+
+    def __init__(self, examples_df):
+        self.examples_df = examples_df.reset_index(drop=True)
+        questions = self.examples_df["Question"].fillna("").astype(str).tolist()
+        for question in questions:
+            if question not in _question_tokens:
+                _question_tokens[question] = tokenize(question)
+        self.index = BM25Index(token_lists=[_question_tokens[question] for question in questions])
+        self.entries = [format_examples(self.examples_df.iloc[[i]]) for i in range(len(self.examples_df))]
+        for entry in self.entries:
+            if entry not in _entry_tokens:
+                _entry_tokens[entry] = count_tokens(entry)
+
+    def select(self, question, k=TOP_K_EXAMPLES, token_budget=EXAMPLES_TOKEN_BUDGET):
+        """Up to k examples most similar to the question whose combined size fits the token budget."""
+        chosen = []
+        used = 0
+        for i in self.index.top_k(question, len(self.entries)):
+            if len(chosen) == k:
+                break
+            tokens = _entry_tokens[self.entries[i]]
+            # Skip an example that does not fit rather than stopping, a shorter one may still fit
+            if used + tokens > token_budget:
+                continue
+            chosen.append(i)
+            used += tokens
+        return "".join(self.entries[i] for i in chosen)
+
+
+def get_example_index():
+    """Return the example index, refreshed when Examples.csv changes."""
+    global _index
+    examples_block = get_examples_block()
+    with _index_lock:
+        if _index is None or _index[0] is not examples_block:
+            _index = (examples_block, ExampleIndex(examples_block.frame))
+        return _index[1]
+
+
+def relevant_examples(question, k=TOP_K_EXAMPLES, token_budget=EXAMPLES_TOKEN_BUDGET):
+    return get_example_index().select(question, k=k, token_budget=token_budget)
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from arrow_result import concat_batches, concat_tables
+from cost_guard import referenced_tables
+from prompt_context import get_schema_block
+from query_pipeline import QUERY_TIMEOUT_SECONDS, QueryCancelled
+from schema_retrieval import match_table
+from sql_validator import DIALECT
+from warehouse import EXTRACT_DIR, WarehouseBackend, duckdb, get_backend, get_duckdb_backend
+
+# Tables most Examples.csv questions read. Rows loaded at or after the watermark are
+# re-fetched and replace earlier versions by key; tables without one are reloaded whole.
+EXTRACT_TABLES = {
+    "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_CONTACTS": {"key": "ID", "watermark": "UUID_TS"},
+    "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_DEALS": {"key": "ID", "watermark": "UUID_TS"},
+    # Small and edited by hand
+    "RUDDER_EVENTS.G_SHEET_FUNNEL_MAPPING.RUDDER_SHEET_1": {"key": None, "watermark": None},
+}
+# Seconds between delta loads when the job runs in the app or with --every
+REFRESH_SECONDS = int(os.environ.get("DBAGENT_EXTRACT_REFRESH_SECONDS", 900))
+# Deleted rows are only dropped by a full reload
+FULL_RELOAD_SECONDS = int(os.environ.get("DBAGENT_EXTRACT_FULL_RELOAD_SECONDS", 24 * 3600))
+# Queries are answered locally only from extracts refreshed within this window
+MAX_AGE_SECONDS = int(os.environ.get("DBAGENT_EXTRACT_MAX_AGE_SECONDS", 3600))
+# Set to 0 to always query the warehouse
+ROUTE_LOCAL = os.environ.get("DBAGENT_ROUTE_LOCAL", "1") != "0"
+# Run the extract job inside the app process instead of from cron
+EXTRACT_IN_APP = os.environ.get("DBAGENT_EXTRACT_IN_APP", "0") == "1"
+
+DATA_FILE = "data.parquet"
+META_FILE = "_extract.json"
+
+logger = logging.getLogger("dbagent.extract")
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def table_dir(table, extract_dir=EXTRACT_DIR):
+    return os.path.join(extract_dir, *table.split("."))
+
+
+def read_meta(table, extract_dir=EXTRACT_DIR):
+    """What was last extracted for table, or None if it never was."""
+    try:
+        with open(os.path.join(table_dir(table, extract_dir), META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def extract_age(table, extract_dir=EXTRACT_DIR):
+    """Seconds since table's extract was last brought up to date, or None."""
+    meta = read_meta(table, extract_dir)
+    return None if meta is None else time.time() - meta["refreshed_at"]
+
+
+def extract_columns(table, spec, schema_df=None):
+    """Columns mirrored for table: those Schema.csv lists, plus the key and watermark."""
+    if schema_df is None:
+        schema_df = get_schema_block().frame
+    columns = schema_df.loc[schema_df["Table Name"] == table, "Column Name"].astype(str).tolist()
+    for extra in (spec.get("key"), spec.get("watermark")):
+        if extra and extra.upper() not in {c.upper() for c in columns}:
+            columns.append(extra)
+    return columns
+
+
+def _field(table, name):
+    # Snowflake returns unquoted identifiers in upper case
+    for field in table.column_names:
+        if field.upper() == name.upper():
+            return field
+    raise KeyError(name)
+
+
+def _write(table, directory):
+    os.makedirs(directory, exist_ok=True)
+    # The temporary name does not end in .parquet, so DuckDB never reads a half-written file
+    tmp_path = os.path.join(directory, f".{DATA_FILE}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, os.path.join(directory, DATA_FILE))
+
+
+def _write_meta(meta, directory):
+    tmp_path = os.path.join(directory, f".{META_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(directory, META_FILE))
+
+
+def extract_table(source, table, spec, columns, extract_dir=EXTRACT_DIR, full=False):
+    """Bring table's local Parquet copy up to date from source; returns the number of rows fetched."""
+    directory = table_dir(table, extract_dir)
+    meta = read_meta(table, extract_dir)
+    watermark = spec.get("watermark")
+    full = (full or meta is None or not watermark or meta.get("watermark") is None
+            or meta["columns"] != columns or time.time() - meta["full_at"] > FULL_RELOAD_SECONDS)
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if not full:
+        # >= rather than >: rows sharing the last load timestamp are fetched again and replaced by key
+        sql += f" WHERE {watermark} >= '{meta['watermark']}'"
+    started = time.time()
+    batches = list(source.stream_batches(sql))
+    if not batches and full:
+        return 0
+
+    new_meta = dict(meta or {}, table=table, columns=columns, refreshed_at=started)
+    if full:
+        new_meta.update(full_at=started, watermark=None)
+    if batches:
+        fetched = concat_batches(batches)
+        data = fetched
+        if not full:
+            existing = pq.read_table(os.path.join(directory, DATA_FILE))
+            key = spec["key"]
+            replaced = pc.is_in(existing[_field(existing, key)], value_set=fetched[_field(fetched, key)])
+            data = concat_tables([existing.filter(pc.invert(replaced)), fetched])
+        _write(data, directory)
+        new_meta["rows"] = data.num_rows
+        if watermark:
+            # The source's own load times, so clock differences with this machine do not matter
+            latest = pc.max(fetched[_field(fetched, watermark)]).as_py()
+            if latest is not None:
+                new_meta["watermark"] = str(latest.replace(tzinfo=None) if hasattr(latest, "tzinfo") else latest)
+    _write_meta(new_meta, directory)
+    return sum(batch.num_rows for batch in batches)
+
+
+class ExtractJob:
+    """Keeps local Parquet extracts of the hot tables up to date with watermark-based delta loads."""
+
+    def __init__(self, source, extract_dir=EXTRACT_DIR, tables=EXTRACT_TABLES, refresh_seconds=REFRESH_SECONDS):
+        self.source = source
+        self.extract_dir = extract_dir
+        self.tables = tables
+        self.refresh_seconds = refresh_seconds
+        self.last_error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run_once(self, full=False):
+        """Refresh every table once; a table that fails keeps its previous extract."""
+        schema_df = get_schema_block().frame
+        loaded = {}
+        for table, spec in self.tables.items():
+            started = time.monotonic()
+            try:
+                loaded[table] = extract_table(self.source, table, spec, extract_columns(table, spec, schema_df),
+                                              self.extract_dir, full)
+                logger.info("extracted %s: %d rows in %.1fs", table, loaded[table], time.monotonic() - started)
+            except Exception as e:
+                self.last_error = f"{table}: {e}"
+                logger.warning("extract of %s failed: %s", table, e)
+        if duckdb is not None:
+            # Tables extracted for the first time need a view
+            get_duckdb_backend(self.extract_dir).refresh()
+        return loaded
+
+    def _run(self):
+        while True:
+            self.run_once()
+            time.sleep(self.refresh_seconds)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dbagent-extract", daemon=True)
+                self._thread.start()
+        return self
+
+
+def get_extract_job(source, extract_dir=EXTRACT_DIR):
+    """Return the process-wide extract job for extract_dir, started in the background."""
+    key = os.path.abspath(extract_dir)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None:
+            job = _jobs[key] = ExtractJob(source, extract_dir)
+        return job.start()
+
+
+def local_tables(sql, extract_dir=EXTRACT_DIR, max_age=MAX_AGE_SECONDS, tables=EXTRACT_TABLES):
+    """Extracted tables sql reads, or None unless every table it reads is extracted and fresh."""
+    matched = []
+    for reference in referenced_tables(sql):
+        table = match_table(reference, list(tables))
+        age = extract_age(table, extract_dir) if table is not None else None
+        if age is None or age > max_age:
+            return None
+        matched.append(table)
+    return matched or None
+
+
+class LocalFirstBackend(WarehouseBackend):
+    """Answers a query from the local extracts when every table it reads is extracted and fresh.
+
+    Everything else, and any query the local engine cannot run (for example
+    SQL that does not transpile cleanly), goes to the remote warehouse.
+    """
+
+    kind = "local-first"
+
+    def __init__(self, remote, local, extract_dir=EXTRACT_DIR, max_age=MAX_AGE_SECONDS):
+        self.remote = remote
+        self.local = local
+        self.extract_dir = extract_dir
+        self.max_age = max_age
+        self.source_dialect = remote.source_dialect
+
+    @property
+    def namespace(self):
+        return self.remote.namespace
+
+    def namespace_for(self, sql):
+        # Local answers are cached apart from the warehouse's: the engines can differ in types and rounding
+        return self.local.namespace if self.routes_locally(sql) else self.remote.namespace
+
+    def routes_locally(self, sql):
+        tables = local_tables(sql, self.extract_dir, self.max_age)
+        if tables is None:
+            return False
+        if not set(tables) <= set(self.local.tables):
+            # Extracted by another process since the views were made
+            self.local.refresh()
+        return set(tables) <= set(self.local.tables)
+
+    def _local_first(self, sql, run_local, run_remote):
+        if self.routes_locally(sql):
+            try:
+                return run_local()
+            except QueryCancelled:
+                raise
+            except Exception as e:
+                # The hot tables are small, so the fallback skips a second cost check
+                logger.info("local engine could not run the query, using the warehouse: %s", e)
+        return run_remote()
+
+    def connection(self):
+        return self.remote.connection()
+
+    def execute(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        return self._local_first(sql, lambda: self.local.execute(sql, progress, timeout),
+                                 lambda: self.remote.execute(sql, progress, timeout))
+
+    def stream_batches(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        backend = self.local if self.routes_locally(sql) else self.remote
+        return backend.stream_batches(sql, progress, timeout)
+
+    def explain(self, sql):
+        return self._local_first(sql, lambda: self.local.explain(sql), lambda: self.remote.explain(sql))
+
+    def describe(self, sql):
+        return self._local_first(sql, lambda: self.local.describe(sql), lambda: self.remote.describe(sql))
+
+    def cancel(self, query_id):
+        if self.local.is_running(query_id):
+            self.local.cancel(query_id)
+        else:
+            self.remote.cancel(query_id)
+
+
+def local_first(remote, extract_dir=EXTRACT_DIR):
+    """remote, answering from fresh local extracts where it can; remote itself when there are none."""
+    if not ROUTE_LOCAL or duckdb is None or remote.source_dialect != DIALECT:
+        return remote
+    if EXTRACT_IN_APP:
+        get_extract_job(remote, extract_dir)
+    if not any(read_meta(table, extract_dir) for table in EXTRACT_TABLES):
+        return remote
+    return LocalFirstBackend(remote, get_duckdb_backend(extract_dir), extract_dir)
+
+
+if __name__ == "__main__":
+    # Scheduled from cron, using the DBAGENT_SNOWFLAKE_* settings
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mirror the hot warehouse tables to local Parquet.")
+    parser.add_argument("--full", action="store_true", help="reload every table from scratch")
+    parser.add_argument("--every", type=int, help="keep running, refreshing every N seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    job = ExtractJob(get_backend("snowflake"))
+    job.run_once(full=args.full)
+    while args.every:
+        time.sleep(args.every)
+        job.run_once()
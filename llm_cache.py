@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.path.join(".dbagent_cache", "llm.sqlite3")
+TTL_SECONDS = 7 * 24 * 3600
+MAX_ENTRIES = 5000
+# Set DBAGENT_LLM_CACHE=off to always call the model
+BYPASS = os.environ.get("DBAGENT_LLM_CACHE", "").lower() in ("0", "off", "false", "no")
+
+# Request arguments that do not change the completion text
+_TRANSPORT_ARGS = {"stream", "timeout", "extra_headers"}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class CompletionCache:
+    """Persistent SQLite cache of model completions with LRU eviction."""
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        # One lock per in-flight key so identical concurrent prompts call the model once
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0}
+
+    @staticmethod
+    def key(model, messages, params):
+        payload = {
+            "model": model,
+            "messages": messages,
+            "params": {k: v for k, v in sorted(params.items()) if k not in _TRANSPORT_ARGS},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute("SELECT response, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return row[0]
+
+    def _store(self, key, model, response):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def _key_lock(self, key):
+        with self._key_locks_lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def get_or_compute(self, model, messages, params, compute, bypass=False, cacheable=None):
+        """Return the cached completion text, calling compute() only on a miss.
+
+        A computed response is stored only if cacheable(response), when given, is true.
+        """
+        if bypass or BYPASS:
+            self.stats["bypassed"] += 1
+            return compute()
+        key = self.key(model, messages, params)
+        cached = self._lookup(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+        lock = self._key_lock(key)
+        with lock:
+            # Another caller may have filled the entry while we waited
+            cached = self._lookup(key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                return cached
+            self.stats["misses"] += 1
+            response = compute()
+            if response and (cacheable is None or cacheable(response)):
+                self._store(key, model, response)
+        with self._key_locks_lock:
+            self._key_locks.pop(key, None)
+        return response
+
+    def clear(self):
+        with self._db_lock:
+            self._db.execute("DELETE FROM completions")
+            self._db.commit()
+
+
+def get_completion_cache():
+    """Return the process-wide completion cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompletionCache()
+        return _cache
+
+
+def chat_completion(client, bypass=False, **kwargs):
+    """Cached client.chat.completions.create(...) returning the message text."""
+    params = {k: v for k, v in kwargs.items() if k not in ("model", "messages")}
+
+    def compute():
+        response = client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return "".join(chunk.choices[0].delta.content or "" for chunk in response if chunk.choices)
+        return response.choices[0].message.content
+
+    return get_completion_cache().get_or_compute(kwargs["model"], kwargs["messages"], params, compute, bypass=bypass)
+
+
+def gemini_completion(model, prompt, bypass=False, **kwargs):
+    """Cached model.generate_content(...) for a Gemini GenerativeModel, returning the text."""
+    model_name = getattr(model, "model_name", type(model).__name__)
+
+    def compute():
+        return model.generate_content(prompt, **kwargs).text
+
+    return get_completion_cache().get_or_compute(model_name, prompt, kwargs, compute, bypass=bypass)
@@ -0,0 +1,96 @@
+import time
+
+from llm_cache import get_completion_cache
+
+# Minimum seconds between placeholder refreshes while tokens arrive
+RENDER_INTERVAL_SECONDS = 0.05
+FENCE = "```"
+
+
+def closed_fence_end(text):
+    """End offset of the first complete ``` fenced block in text, or None while it is still open."""
+    start = text.find(FENCE)
+    if start == -1:
+        return None
+    # The opening fence runs to the end of its line (e.g. ```sql)
+    body = text.find("\n", start)
+    if body == -1:
+        return None
+    end = text.find(FENCE, body)
+    if end == -1:
+        return None
+    return end + len(FENCE)
+
+
+def consume_stream(pieces, placeholder=None, stop_at=closed_fence_end, cancel=None):
+    """Join streamed text pieces, rendering them as they arrive.
+
+    stop_at returns the offset where the useful part of the text ends (by
+    default the close of the first fenced block); the stream is cancelled
+    there, since nothing after it is used.
+    """
+    text = ""
+    last_render = 0.0
+    for piece in pieces:
+        if not piece:
+            continue
+        text += piece
+        if stop_at is not None:
+            end = stop_at(text)
+            if end is not None:
+                text = text[:end]
+                if cancel is not None:
+                    cancel()
+                break
+        now = time.monotonic()
+        if placeholder is not None and now - last_render >= RENDER_INTERVAL_SECONDS:
+            placeholder.markdown(text)
+            last_render = now
+    return text
+
+
+def _answer_kept(stop_at, stopped):
+    # A stream cut short is cached only if what was kept is itself a complete answer,
+    # never a cut made before the answer arrived
+    return lambda text: not stopped or stop_at(text) == len(text)
+
+
+def stream_chat_completion(client, placeholder=None, stop_at=closed_fence_end, bypass=False, **kwargs):
+    """Streaming, cached client.chat.completions.create(...) returning the message text."""
+    params = {k: v for k, v in kwargs.items() if k not in ("model", "messages", "stream")}
+    stopped = []
+
+    def compute():
+        stream = client.chat.completions.create(stream=True, **kwargs)
+        pieces = (chunk.choices[0].delta.content for chunk in stream if chunk.choices)
+
+        def cancel():
+            stopped.append(True)
+            if hasattr(stream, "close"):
+                stream.close()
+
+        return consume_stream(pieces, placeholder, stop_at, cancel=cancel)
+
+    text = get_completion_cache().get_or_compute(kwargs["model"], kwargs["messages"], params, compute,
+                                                 bypass=bypass, cacheable=_answer_kept(stop_at, stopped))
+    if placeholder is not None:
+        placeholder.markdown(text)
+    return text
+
+
+def stream_gemini_completion(model, prompt, placeholder=None, stop_at=closed_fence_end, bypass=False, **kwargs):
+    """Streaming, cached model.generate_content(...) for a Gemini GenerativeModel."""
+    model_name = getattr(model, "model_name", type(model).__name__)
+    stopped = []
+
+    def compute():
+        response = model.generate_content(prompt, stream=True, **kwargs)
+        # Breaking out of the iterator stops reading the rest of the response
+        return consume_stream((chunk.text for chunk in response), placeholder, stop_at,
+                              cancel=lambda: stopped.append(True))
+
+    text = get_completion_cache().get_or_compute(model_name, prompt, kwargs, compute,
+                                                 bypass=bypass, cacheable=_answer_kept(stop_at, stopped))
+    if placeholder is not None:
+        placeholder.markdown(text)
+    return text
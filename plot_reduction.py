@@ -0,0 +1,134 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from data_profile import as_datetime, column_roles
+
+# Results at or below this many rows are plotted as they are
+MAX_PLOT_ROWS = 5000
+# Points kept per line after downsampling, and across all lines of one chart
+MAX_POINTS_PER_SERIES = 1000
+MAX_TOTAL_POINTS = 20000
+# Categories kept per dimension; the rest are summed into OTHER_LABEL
+TOP_CATEGORIES = 20
+OTHER_LABEL = "Other"
+# Time buckets tried, finest first, when a series has more repeated timestamps than points
+_TIME_BUCKETS = [
+    (pd.Timedelta(minutes=1), "floor", "min"),
+    (pd.Timedelta(hours=1), "floor", "h"),
+    (pd.Timedelta(days=1), "floor", "D"),
+    (pd.Timedelta(days=7), "period", "W"),
+    (pd.Timedelta(days=31), "period", "M"),
+    (pd.Timedelta(days=92), "period", "Q"),
+    (pd.Timedelta(days=366), "period", "Y"),
+]
+
+_last = (None, None)
+_last_lock = threading.Lock()
+
+
+def lttb_indices(x, y, threshold):
+    """Row positions kept by Largest-Triangle-Three-Buckets downsampling of the line (x, y)."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.nan_to_num(np.asarray(x, dtype="float64"))
+    y = np.nan_to_num(np.asarray(y, dtype="float64"))
+    # The first and last points are kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Twice the area of the triangle (point a, candidate, next bucket average)
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def top_categories(series, weights, n=TOP_CATEGORIES):
+    """series with all but its n heaviest values replaced by OTHER_LABEL."""
+    totals = weights.groupby(series, dropna=False).sum() if weights is not None else series.value_counts(dropna=False)
+    if len(totals) <= n:
+        return series
+    keep = totals.nlargest(n).index
+    return series.astype(object).where(series.isin(keep), OTHER_LABEL)
+
+
+def bucket_times(dates, limit):
+    """dates floored to the finest bucket that leaves at most limit buckets over their span."""
+    span = dates.max() - dates.min()
+    for width, kind, freq in _TIME_BUCKETS:
+        if span / width <= limit:
+            break
+    if kind == "floor":
+        return dates.dt.floor(freq)
+    return dates.dt.to_period(freq).dt.start_time
+
+
+def _reduce_series(df, date, metrics, limit):
+    """Bucket repeated timestamps, then LTTB-downsample each metric of one line."""
+    if df[date].duplicated().any():
+        # Repeated timestamps mean raw rows rather than a series: aggregate them per time bucket
+        if df[date].nunique() > limit:
+            df = df.assign(**{date: bucket_times(df[date], limit)})
+        rest = {c: "first" for c in df.columns if c != date and c not in metrics}
+        df = df.groupby(date, as_index=False, sort=True).agg({**{m: "sum" for m in metrics}, **rest})
+    if len(df) <= limit:
+        return df
+    x = (df[date] - df[date].min()).dt.total_seconds().to_numpy()
+    keep = np.unique(np.concatenate([lttb_indices(x, df[m].to_numpy(dtype="float64", na_value=np.nan), limit)
+                                     for m in metrics]))
+    return df.iloc[keep]
+
+
+def _reduce(df):
+    dates, dimensions, metrics = column_roles(df)
+    if dimensions and metrics:
+        weights = df[metrics[0]].abs()
+        df = df.assign(**{d: top_categories(df[d], weights) for d in dimensions})
+    if len(dates) == 1 and metrics:
+        date = dates[0]
+        df = df.assign(**{date: as_datetime(df[date])}).sort_values(date)
+        if not dimensions:
+            return _reduce_series(df, date, metrics, MAX_POINTS_PER_SERIES).reset_index(drop=True)
+        groups = df.groupby(dimensions, dropna=False, sort=False)
+        limit = max(3, min(MAX_POINTS_PER_SERIES, MAX_TOTAL_POINTS // groups.ngroups))
+        parts = [_reduce_series(group, date, metrics, limit) for _, group in groups]
+        return pd.concat(parts, ignore_index=True)
+    if dimensions and metrics and not dates:
+        # Category results: sum whatever was folded into "Other"
+        grouped = df.groupby(dimensions, dropna=False, sort=False, as_index=False)[metrics].sum()
+        if len(grouped) <= MAX_PLOT_ROWS:
+            return grouped
+        df = grouped
+    # Anything else (scatter-like rows) is thinned to evenly spaced rows
+    return df.iloc[np.linspace(0, len(df) - 1, MAX_PLOT_ROWS).astype(int)].reset_index(drop=True)
+
+
+def reduce_for_plot(df):
+    """Frame with the same columns as df, small enough to send to the browser.
+
+    Results of up to MAX_PLOT_ROWS rows are returned unchanged. Larger ones are
+    reduced by top-N categories, time bucketing and LTTB downsampling, so chart
+    code sees an ordinary `df` whatever the result size.
+    """
+    global _last
+    if not isinstance(df, pd.DataFrame) or len(df) <= MAX_PLOT_ROWS:
+        return df
+    # Several chart paths reduce the same result in turn; keep the last reduction
+    with _last_lock:
+        ref, reduced = _last
+        if ref is not None and ref() is df:
+            return reduced
+    reduced = _reduce(df)
+    with _last_lock:
+        _last = (weakref.ref(df), reduced)
+    return reduced
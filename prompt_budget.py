@@ -0,0 +1,103 @@
+from prompt_context import count_tokens, get_encoder
+
+# Context window per model family; fine-tuned models use their base model's window
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "gemini-1.5-flash": 1048576,
+    "gemini-1.5-pro": 2097152,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+# Cap on prompt size even for large-context models, so long sessions do not send bloated prompts
+MAX_PROMPT_TOKENS = 16000
+# Room for the instruction text wrapped around the sections
+TEMPLATE_RESERVE_TOKENS = 256
+TRUNCATION_MARKER = "[... trimmed to fit the context budget]"
+
+
+class PromptSection:
+    """A named, trimmable part of a prompt; lower priority is trimmed first."""
+
+    def __init__(self, name, text, priority, keep="head", min_tokens=0):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        # "head" keeps the start of the text (schema, examples, data), "tail" the end (conversation)
+        self.keep = keep
+        self.min_tokens = min_tokens
+
+
+def model_context_tokens(model):
+    name = model.split("/")[-1]
+    if name.startswith("ft:"):
+        name = name[3:]
+    for prefix in sorted(MODEL_CONTEXT_TOKENS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_TOKENS[prefix]
+    return DEFAULT_CONTEXT_TOKENS
+
+
+def prompt_budget(model, max_output_tokens=0):
+    """Tokens available for the prompt once the completion has been reserved."""
+    return min(model_context_tokens(model) - max_output_tokens, MAX_PROMPT_TOKENS)
+
+
+def _hard_truncate(text, max_tokens, keep):
+    tokens = get_encoder().encode(text)
+    kept = tokens[:max_tokens] if keep == "head" else tokens[-max_tokens:]
+    return get_encoder().decode(kept)
+
+
+def trim_text(text, max_tokens, keep="head"):
+    """Drop whole entries (blank-line or line separated) from the far end until the text fits."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    marker_tokens = count_tokens(TRUNCATION_MARKER) + 1
+    if max_tokens <= marker_tokens:
+        return ""
+    separator = "\n\n" if "\n\n" in text.strip() else "\n"
+    chunks = text.split(separator)
+    if keep == "tail":
+        chunks.reverse()
+    kept = []
+    used = marker_tokens
+    for chunk in chunks:
+        size = count_tokens(chunk + separator)
+        if used + size > max_tokens:
+            break
+        kept.append(chunk)
+        used += size
+    if not kept:
+        # A single entry is larger than the budget, so cut it at a token boundary
+        kept = [_hard_truncate(chunks[0], max_tokens - marker_tokens, keep)]
+    if keep == "tail":
+        kept.reverse()
+        return TRUNCATION_MARKER + "\n" + separator.join(kept)
+    return separator.join(kept) + "\n" + TRUNCATION_MARKER
+
+
+def fit_sections(sections, budget):
+    """Trim sections, lowest priority first, until their total fits the budget."""
+    texts = {section.name: section.text for section in sections}
+    sizes = {section.name: count_tokens(section.text) for section in sections}
+    overflow = sum(sizes.values()) - budget
+    for section in sorted(sections, key=lambda s: s.priority):
+        if overflow <= 0:
+            break
+        allowed = max(section.min_tokens, sizes[section.name] - overflow)
+        if allowed >= sizes[section.name]:
+            continue
+        texts[section.name] = trim_text(section.text, allowed, section.keep)
+        trimmed_size = count_tokens(texts[section.name])
+        overflow -= sizes[section.name] - trimmed_size
+        sizes[section.name] = trimmed_size
+    if overflow > 0:
+        raise ValueError("Prompt is too long and exceeds the token limit for the model.")
+    return texts
+
+
+def fit_prompt(model, sections, fixed_text="", max_output_tokens=0):
+    """Fit prompt sections into the model's budget after the fixed text and output are reserved."""
+    budget = prompt_budget(model, max_output_tokens) - count_tokens(fixed_text) - TEMPLATE_RESERVE_TOKENS
+    return fit_sections(sections, budget)
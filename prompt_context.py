@@ -0,0 +1,87 @@
+import os
+import threading
+from functools import lru_cache
+
+import pandas as pd
+import tiktoken
+
+SCHEMA_PATH = "Schema.csv"
+EXAMPLES_PATH = "Examples.csv"
+ENCODING_NAME = "cl100k_base"
+
+# Built blocks keyed by (kind, path), each stored with the file signature it was built from.
+# Module state survives Streamlit reruns, so sources are only re-read when the file changes.
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name=ENCODING_NAME):
+    """Return a shared tiktoken encoder instead of rebuilding it per call."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text, encoding_name=ENCODING_NAME):
+    return len(get_encoder(encoding_name).encode(text))
+
+
+class PromptBlock:
+    """Prompt text built from a source file, with its token count computed once."""
+
+    def __init__(self, text, frame):
+        self.text = text
+        self.frame = frame
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = count_tokens(self.text)
+        return self._tokens
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cached_block(kind, path, build):
+    signature = _file_signature(path)
+    with _blocks_lock:
+        entry = _blocks.get((kind, path))
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+    block = build(pd.read_csv(path))
+    with _blocks_lock:
+        _blocks[(kind, path)] = (signature, block)
+    return block
+
+
+def format_schema(schema_df):
+    """Render schema rows as 'Table/Column/Description' entries."""
+    entries = (
+        "Table: " + schema_df["Table Name"].astype(str)
+        + "\nColumn: " + schema_df["Column Name"].astype(str)
+        + "\nDescription: " + schema_df["Column Description"].astype(str)
+        + "\n\n"
+    )
+    return entries.str.cat()
+
+
+def format_examples(examples_df):
+    """Render example rows as 'Question/Query' pairs."""
+    entries = (
+        "Question: " + examples_df["Question"].astype(str)
+        + "\nQuery: " + examples_df["Query"].astype(str)
+        + "\n\n"
+    )
+    return entries.str.cat()
+
+
+def get_schema_block(path=SCHEMA_PATH):
+    return _cached_block("schema", path, lambda df: PromptBlock(format_schema(df), df))
+
+
+def get_examples_block(path=EXAMPLES_PATH):
+    return _cached_block("examples", path, lambda df: PromptBlock(format_examples(df), df))
@@ -2,6 +2,10 @@ import pandas as pd
 import openai
 import streamlit as st
 import os
+from conversation_memory import build_conversation
+from llm_cache import chat_completion
+from prompt_budget import PromptSection, fit_prompt
+from prompt_context import get_schema_block, get_examples_block
 
 # Ensure session state is initialized at the very beginning
 if 'messages' not in st.session_state:
@@ -10,43 +14,39 @@ if 'messages' not in st.session_state:
 openai.api_key = st.secrets.credentials.api_key
 
 def generate_pseudocode(conversation):
+    system_prompt = "You are a Query Expert who generates step-wise instructions for SQL Query generation. Keep it short and accurate. Dont give SQL Query in response"
+    # Fit schema, examples and conversation into the model's context budget, trimming examples first
+    sections = fit_prompt("gpt-4o", [
+        PromptSection("schema", schema_info, priority=3),
+        PromptSection("examples", examples, priority=1),
+        PromptSection("conversation", conversation, priority=2, keep="tail"),
+    ], fixed_text=system_prompt, max_output_tokens=2000)
     prompt = f"""
     You are an expert at generating step-wise instructions for SQL generation. Given the following schema and examples, generate human-readable instructions for the given question in steps. Each step should clearly define actions like selecting columns, specifying table names, applying filters, and joining tables.
     Schema:
-    {schema_info}
+    {sections['schema']}
     Examples:
-    {examples}
+    {sections['examples']}
     Conversation:
-    {conversation}
+    {sections['conversation']}
     """
-    response = openai.chat.completions.create(
+    response = chat_completion(
+        openai,
         model="gpt-4o",
         messages=[
-            {"role": "system", "content": "You are a Query Expert who generates step-wise instructions for SQL Query generation. Keep it short and accurate. Dont give SQL Query in response"},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ],
         max_tokens=2000,
         temperature=0.1
     )
-    return response.choices[0].message.content.strip()
+    return response.strip()
 
 
 if openai.api_key:
-    # Load schema CSV
-    schema_file_path = 'Schema.csv'
-    schema_df = pd.read_csv(schema_file_path)
-    # Load examples CSV
-    examples_file_path = 'Examples.csv'
-    examples_df = pd.read_csv(examples_file_path)
-
-    # Prepare schema information
-    schema_info = ""
-    for _, row in schema_df.iterrows():
-        schema_info += f"Table: {row['Table Name']}\nColumn: {row['Column Name']}\nDescription: {row['Column Description']}\n\n"
-    # Prepare examples
-    examples = ""
-    for _, row in examples_df.iterrows():
-        examples += f"Question: {row['Question']}\nQuery: {row['Query']}\n\n"
+    # Schema and example prompt blocks are built once per process and reused across reruns
+    schema_info = get_schema_block().text
+    examples = get_examples_block().text
 
 
     st.title("Step-wise Pseudocode Generator")
@@ -55,7 +55,7 @@ if openai.api_key:
     user_question = st.text_input("Ask your question:")
     if st.button("Generate Pseudocode"):
         if user_question:
-            conversation = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
+            conversation = build_conversation(st.session_state.messages)
             pseudocode = generate_pseudocode(conversation + f"\nUser: {user_question}")
             st.session_state.messages.append({"role": "user", "content": user_question})
             st.session_state.messages.append({"role": "assistant", "content": pseudocode})
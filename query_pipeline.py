@@ -0,0 +1,315 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pandas as pd
+
+from llm_stream import FENCE, closed_fence_end
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx = get_script_run_ctx = None
+
+try:
+    from snowflake.connector.constants import FIELD_ID_TO_NAME
+except ImportError:
+    FIELD_ID_TO_NAME = {}
+
+SQL_MARKER = "Generated SQL Query:"
+_STATEMENT_START_RE = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Worker threads shared by every session. Queries and chart-code requests have separate pools,
+# so model calls never keep a query waiting for a thread
+QUERY_WORKERS = int(os.environ.get("DBAGENT_QUERY_WORKERS", 4))
+CHART_WORKERS = int(os.environ.get("DBAGENT_CHART_WORKERS", 4))
+# A question's query is cancelled on the server once it runs longer than this
+QUERY_TIMEOUT_SECONDS = int(os.environ.get("DBAGENT_QUERY_TIMEOUT_SECONDS", 300))
+POLL_INTERVAL_SECONDS = 0.5
+# Scan statistics come from query history, which is too slow to read on every poll
+STATS_INTERVAL_SECONDS = 2.0
+
+_STATS_SQL = (
+    "SELECT BYTES_SCANNED, ROWS_PRODUCED "
+    "FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 100)) WHERE QUERY_ID = %s"
+)
+
+# Pandas dtypes for Snowflake column types, used to describe a result before it is fetched
+_SNOWFLAKE_DTYPES = {
+    "REAL": "float64",
+    "BOOLEAN": "bool",
+    "DATE": "datetime64[ns]",
+    "TIMESTAMP": "datetime64[ns]",
+    "TIMESTAMP_NTZ": "datetime64[ns]",
+    "TIMESTAMP_LTZ": "datetime64[ns]",
+    "TIMESTAMP_TZ": "datetime64[ns]",
+}
+
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="dbagent-query")
+_chart_executor = ThreadPoolExecutor(max_workers=CHART_WORKERS, thread_name_prefix="dbagent-chart")
+
+
+def sql_statement_end(text, require_marker=True):
+    """Offset where the streamed SQL answer is complete, or None while it is still arriving.
+
+    A fenced answer is complete when its fence closes; an unfenced one at its
+    first top-level semicolon after the "Generated SQL Query:" marker. Prose
+    before the marker may contain semicolons, so nothing is cut until it has
+    arrived. Without require_marker, an answer that starts straight with the
+    statement (the prompt itself ended with the marker) is scanned from the top.
+    """
+    if FENCE in text:
+        return closed_fence_end(text)
+    start = text.find(SQL_MARKER)
+    if start != -1:
+        i = start + len(SQL_MARKER)
+    elif not require_marker and _STATEMENT_START_RE.match(text):
+        i = 0
+    else:
+        return None
+    quote = None
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif text.startswith("--", i):
+            newline = text.find("\n", i)
+            if newline == -1:
+                return None
+            i = newline
+        elif text.startswith("/*", i):
+            close = text.find("*/", i + 2)
+            if close == -1:
+                return None
+            i = close + 1
+        elif char == ";":
+            return i + 1
+        i += 1
+    return None
+
+
+def bare_sql_statement_end(text):
+    """sql_statement_end for prompts that end with the marker, so the reply starts with the SQL."""
+    return sql_statement_end(text, require_marker=False)
+
+
+def empty_frame(description):
+    """Zero-row DataFrame with the columns and dtypes of a cursor description."""
+    columns = {}
+    for column in description:
+        type_name = FIELD_ID_TO_NAME.get(column.type_code, "")
+        if type_name == "FIXED":
+            dtype = "Int64" if not column.scale else "float64"
+        else:
+            dtype = _SNOWFLAKE_DTYPES.get(type_name, "object")
+        columns[column.name] = pd.Series(dtype=dtype)
+    return pd.DataFrame(columns)
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class QueryTimeout(QueryCancelled):
+    pass
+
+
+class QueryError(str):
+    """Error text returned in place of a result, with the kind of failure.
+
+    kind is "invalid" (caught by local validation), "error" (the warehouse
+    refused or failed it), "rejected" (the cost guard would not run it),
+    "timeout" or "cancelled".
+    """
+
+    def __new__(cls, text, kind="error"):
+        error = super().__new__(cls, text)
+        error.kind = kind
+        return error
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class QueryProgress:
+    """State of a running query, shared by the worker that runs it and the script that shows it."""
+
+    def __init__(self):
+        self.query_id = None
+        self.started = time.monotonic()
+        self.queued = False
+        self.bytes_scanned = None
+        self.rows_produced = None
+        self._cancel = threading.Event()
+
+    def start(self):
+        """Start the clock when a worker picks the query up; time spent queued does not count."""
+        self.started = time.monotonic()
+        self.queued = False
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Ask the worker to cancel the query on the server at its next poll."""
+        self._cancel.set()
+
+    def describe(self):
+        if self.queued:
+            return "Waiting for a free worker"
+        parts = [f"Running for {self.elapsed:.0f}s"]
+        if self.bytes_scanned is not None:
+            parts.append(f"{format_bytes(self.bytes_scanned)} scanned")
+        if self.rows_produced is not None:
+            parts.append(f"{self.rows_produced:,} rows so far")
+        return " · ".join(parts)
+
+
+def cancel_query(conn, query_id):
+    """Cancel a running query on the Snowflake side."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT SYSTEM$CANCEL_QUERY(%s)", (query_id,))
+    finally:
+        cursor.close()
+
+
+def _update_stats(conn, progress):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_STATS_SQL, (progress.query_id,))
+        row = cursor.fetchone()
+    except Exception:
+        return
+    finally:
+        cursor.close()
+    if row:
+        progress.bytes_scanned, progress.rows_produced = row
+
+
+def run_async(conn, cursor, query, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+    """Run query with execute_async and poll it, cancelling it on timeout or when progress is cancelled.
+
+    On return the cursor holds the query's results, ready to fetch.
+    """
+    if progress is None:
+        progress = QueryProgress()
+    if progress.cancelled:
+        raise QueryCancelled("Query cancelled before it started.")
+    cursor.execute_async(query)
+    progress.query_id = cursor.sfqid
+    last_stats = 0.0
+    while conn.is_still_running(conn.get_query_status_throw_if_error(progress.query_id)):
+        if progress.cancelled or progress.elapsed > timeout:
+            cancel_query(conn, progress.query_id)
+            if progress.cancelled:
+                raise QueryCancelled("Query cancelled.")
+            raise QueryTimeout(f"Query ran longer than {timeout}s and was cancelled.")
+        if time.monotonic() - last_stats >= STATS_INTERVAL_SECONDS:
+            _update_stats(conn, progress)
+            last_stats = time.monotonic()
+        time.sleep(POLL_INTERVAL_SECONDS)
+    cursor.get_results_from_sfqid(progress.query_id)
+    return progress.query_id
+
+
+def _submit(executor, fn, *args, on_start=None):
+    # Worker threads inherit the script context so Streamlit calls inside them still work
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+    def run():
+        if ctx is not None:
+            add_script_run_ctx(ctx=ctx)
+        if on_start is not None:
+            on_start()
+        return fn(*args)
+
+    return executor.submit(run)
+
+
+class PendingQuery:
+    """A query running in the background, with chart code optionally generated alongside it."""
+
+    def __init__(self, sql, result_future, chart_future, generate_chart_code, progress=None):
+        self.sql = sql
+        self.result_future = result_future
+        self.chart_future = chart_future
+        self.generate_chart_code = generate_chart_code
+        self.progress = progress or QueryProgress()
+
+    def result(self, timeout=None):
+        return self.result_future.result(timeout)
+
+    def wait(self, placeholder=None):
+        """Block until the result is ready, showing progress in placeholder.
+
+        Streamlit stops or reruns a script (Stop button, a new question) by
+        raising from its next st call, so the query is cancelled on the server
+        when that happens while waiting.
+        """
+        try:
+            while True:
+                try:
+                    result = self.result_future.result(POLL_INTERVAL_SECONDS)
+                    break
+                except FutureTimeout:
+                    if placeholder is not None:
+                        placeholder.caption(self.progress.describe())
+        except BaseException:
+            self.progress.cancel()
+            raise
+        if placeholder is not None:
+            placeholder.empty()
+        return result
+
+    def chart_code(self, result):
+        """Chart code prepared while the query ran, or generated now from the fetched result."""
+        if self.chart_future is not None:
+            try:
+                response = self.chart_future.result()
+            except Exception:
+                response = None
+            if response:
+                return response
+        return self.generate_chart_code(result)
+
+
+def start_query(sql, execute_query, describe_query=None, generate_chart_code=None, skip_chart=None):
+    """Submit the query at once and, when its columns can be described, start chart generation in parallel.
+
+    execute_query(sql, progress) receives a QueryProgress to report on and to
+    watch for cancellation.
+
+    skip_chart(columns_frame) returning True means the result will be charted
+    without the model, so no chart code is requested up front.
+    """
+    progress = QueryProgress()
+    # The timeout runs from when a worker starts the query, not from when it was queued
+    progress.queued = True
+    result_future = _submit(_query_executor, execute_query, sql, progress, on_start=progress.start)
+    chart_future = None
+    if describe_query is not None and generate_chart_code is not None:
+        try:
+            columns_frame = describe_query(sql)
+        except Exception:
+            columns_frame = None
+        # Cached or fast results are already back, so charting from the real frame costs nothing extra
+        if columns_frame is not None and len(columns_frame.columns) and not result_future.done():
+            if skip_chart is None or not skip_chart(columns_frame):
+                chart_future = _submit(_chart_executor, generate_chart_code, columns_frame)
+    return PendingQuery(sql, result_future, chart_future, generate_chart_code, progress)
@@ -0,0 +1,256 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from arrow_result import ArrowResult
+
+CACHE_DIR = os.path.join(".dbagent_cache", "results")
+TTL_SECONDS = 3600
+MAX_ENTRIES = 256
+MAX_BYTES = 256 * 1024 * 1024
+
+_TOKEN_RE = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*")
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<op><=|>=|<>|!=|\|\||::|.)
+""", re.S | re.X)
+
+_READ_ONLY_STATEMENTS = {"SELECT", "WITH", "SHOW", "DESCRIBE", "DESC"}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def tokenize_sql(sql):
+    """(kind, text) tokens of a statement without comments, whitespace or trailing semicolons."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        text = match.group()
+        # Keywords and unquoted identifiers are case-insensitive; literals and quoted identifiers are not
+        tokens.append((kind, text.upper() if kind == "word" else text))
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    return tokens
+
+
+def _body_end(sql):
+    # End offset of the last token that is not a comment, whitespace or semicolon; quoted
+    # text is one token, so "--" inside a string literal is never taken for a comment
+    end = 0
+    for match in _TOKEN_RE.finditer(sql):
+        if match.lastgroup not in ("comment", "space") and match.group() != ";":
+            end = match.end()
+    return end
+
+
+def _literal_list_end(tokens, i):
+    # Index of the closing paren when tokens[i:] reads "IN ( literal, literal, ... )"
+    if tokens[i][1] != "IN" or i + 2 >= len(tokens) or tokens[i + 1][1] != "(":
+        return None
+    j = i + 2
+    while j < len(tokens) and tokens[j][0] in ("string", "number"):
+        if j + 1 < len(tokens) and tokens[j + 1][1] == ",":
+            j += 2
+        elif j + 1 < len(tokens) and tokens[j + 1][1] == ")":
+            return j + 1
+        else:
+            return None
+    return None
+
+
+def _sort_in_lists(tokens):
+    out = []
+    i = 0
+    while i < len(tokens):
+        end = _literal_list_end(tokens, i)
+        if end is None:
+            out.append(tokens[i])
+            i += 1
+            continue
+        # IN-list membership does not depend on order, so put the literals in a stable one
+        literals = sorted(set(t for t in tokens[i + 2:end] if t[1] != ","))
+        out.extend(tokens[i:i + 2])
+        for k, literal in enumerate(literals):
+            if k:
+                out.append(("op", ","))
+            out.append(literal)
+        out.append(tokens[end])
+        i = end + 1
+    return out
+
+
+def normalize_sql(sql):
+    """Canonical form of a SQL statement used as the cache key."""
+    tokens = _sort_in_lists(tokenize_sql(sql))
+    return " ".join(text for _, text in tokens)
+
+
+def is_cacheable(sql):
+    tokens = tokenize_sql(sql)
+    return bool(tokens) and tokens[0][1] in _READ_ONLY_STATEMENTS
+
+
+def has_row_limit(sql):
+    """Whether the statement already ends in a top-level LIMIT or FETCH clause."""
+    depth = 0
+    for kind, text in tokenize_sql(sql):
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word" and text in ("LIMIT", "FETCH"):
+            return True
+    return False
+
+
+def with_limit(sql, limit):
+    """sql with LIMIT appended when it is a query without one of its own."""
+    tokens = tokenize_sql(sql)
+    if not tokens or tokens[0][1] not in ("SELECT", "WITH") or has_row_limit(sql):
+        return sql
+    # Drop the trailing semicolon and comments so the clause is not swallowed by a "--" line
+    return f"{sql[:_body_end(sql)]}\nLIMIT {int(limit)}"
+
+
+class ResultCache:
+    """On-disk LRU cache of query results stored as Parquet, with TTL expiry."""
+
+    def __init__(self, directory=CACHE_DIR, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # Rebuild the index from disk, oldest first, so cached results survive restarts
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, name[:-len(".parquet")], stat.st_size))
+        for mtime, key, size in sorted(found):
+            self._entries[key] = {"size": size, "stored_at": mtime}
+            self._bytes += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".parquet")
+
+    def key(self, sql, namespace=""):
+        return hashlib.sha256(f"{namespace}\n{normalize_sql(sql)}".encode("utf-8")).hexdigest()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry["size"]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def get(self, sql, namespace=""):
+        """Return the cached ArrowResult for this query, or None on a miss."""
+        if not is_cacheable(sql):
+            return None
+        key = self.key(sql, namespace)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if time.time() - entry["stored_at"] > self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            # Memory-mapped, so the table's buffers are read from the page cache without a copy
+            result = ArrowResult(pq.read_table(self._path(key), memory_map=True))
+        except Exception:
+            with self._lock:
+                self._remove(key)
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return result
+
+    def put(self, sql, result, namespace=""):
+        """Store an ArrowResult or DataFrame; anything that cannot be written as Parquet is skipped."""
+        if not isinstance(result, (ArrowResult, pd.DataFrame)) or not is_cacheable(sql):
+            return
+        key = self.key(sql, namespace)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            table = result.table if isinstance(result, ArrowResult) else ArrowResult.from_pandas(result).table
+            pq.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous["size"]
+            self._entries[key] = {"size": size, "stored_at": time.time()}
+            self._bytes += size
+            self._stats["stores"] += 1
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def get_result_cache():
+    """Return the process-wide result cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
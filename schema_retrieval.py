@@ -0,0 +1,147 @@
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from prompt_context import count_tokens, format_schema, get_examples_block, get_schema_block
+from text_index import BM25Index
+
+SCHEMA_TOKEN_BUDGET = 1500
+TOP_K_TABLES = 3
+# Number of best-matching columns that contribute to a table's score
+COLUMNS_PER_TABLE_SCORE = 3
+
+_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)(?:\s+AS)?\s+([A-Za-z_]\w*)", re.I)
+_SUBQUERY_ALIAS_RE = re.compile(r"\)\s*AS\s+([A-Za-z_]\w*)", re.I)
+_FROM_RE = re.compile(r"\bFROM\s+([A-Za-z_][\w.]*)", re.I)
+_JOIN_CONDITION_RE = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b[\s)]*=[\s(]*(?:\w+\s*\(\s*)*([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+_NOT_ALIASES = {"ON", "WHERE", "LEFT", "RIGHT", "INNER", "OUTER", "FULL", "CROSS", "JOIN", "GROUP", "ORDER",
+                "LIMIT", "UNION", "QUALIFY", "HAVING", "USING", "NATURAL", "LATERAL"}
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def match_table(reference, tables):
+    """The schema table a (possibly partly qualified) table reference names, or None."""
+    # Schema.csv mixes fully qualified and schema.table names, so match on a dotted suffix
+    reference = reference.upper()
+    for table in tables:
+        upper = table.upper()
+        if upper == reference or upper.endswith("." + reference) or reference.endswith("." + upper):
+            return table
+    return None
+
+
+def find_join_keys(schema_df, examples_df):
+    """Join conditions used in the example queries whose columns all exist in the schema."""
+    columns = {}
+    for table, column in zip(schema_df["Table Name"].astype(str), schema_df["Column Name"].astype(str)):
+        columns.setdefault(table, {})[column.upper()] = column
+    tables = list(columns)
+
+    keys = set()
+    for query in examples_df["Query"].dropna().astype(str):
+        aliases = []
+        for match in _ALIAS_RE.finditer(query):
+            if match.group(2).upper() not in _NOT_ALIASES:
+                aliases.append((match.start(), match.group(2).upper(), match.group(1)))
+        for match in _SUBQUERY_ALIAS_RE.finditer(query):
+            inner = list(_FROM_RE.finditer(query, 0, match.start()))
+            if inner:
+                aliases.append((match.start(), match.group(1).upper(), inner[-1].group(1)))
+        aliases.sort()
+
+        for match in _JOIN_CONDITION_RE.finditer(query):
+            # Resolve each alias to its most recent definition before the condition
+            visible = {alias: table for position, alias, table in aliases if position < match.start()}
+            left = match_table(visible.get(match.group(1).upper(), match.group(1)), tables)
+            right = match_table(visible.get(match.group(3).upper(), match.group(3)), tables)
+            if not left or not right or left == right:
+                continue
+            left_column = columns[left].get(match.group(2).upper())
+            right_column = columns[right].get(match.group(4).upper())
+            if left_column and right_column:
+                keys.add(tuple(sorted([(left, left_column), (right, right_column)])))
+    return sorted(keys)
+
+
+class SchemaIndex:
+    """BM25 index over schema columns used to pick the tables relevant to a question."""
+
+    def __init__(self, schema_df, examples_df):
+        self.schema_df = schema_df.reset_index(drop=True)
+        self.tables = self.schema_df["Table Name"].astype(str).to_numpy()
+        documents = (
+            self.schema_df["Table Name"].astype(str) + " " + self.schema_df["Column Name"].astype(str)
+            + " " + self.schema_df["Column Description"].fillna("").astype(str)
+            + " " + self.schema_df["Table Description"].fillna("").astype(str)
+        )
+        self.index = BM25Index(documents.tolist())
+        self.entries = [format_schema(self.schema_df.iloc[[i]]) for i in range(len(self.schema_df))]
+        self.entry_tokens = np.array([count_tokens(entry) for entry in self.entries], dtype=np.int64)
+        self.join_keys = find_join_keys(self.schema_df, examples_df)
+        self._row_of = {(t, c): i for i, (t, c) in enumerate(zip(self.tables, self.schema_df["Column Name"].astype(str)))}
+        self._neighbours = {}
+        for (left, _), (right, _) in self.join_keys:
+            self._neighbours.setdefault(left, set()).add(right)
+            self._neighbours.setdefault(right, set()).add(left)
+
+    def _bridge(self, selected):
+        # Add one intermediate table for selected pairs that only join through it
+        bridges = set()
+        for a in selected:
+            for b in selected:
+                if a < b and b not in self._neighbours.get(a, ()):
+                    common = sorted(self._neighbours.get(a, set()) & self._neighbours.get(b, set()))
+                    if common:
+                        bridges.add(common[0])
+        return selected | bridges
+
+    def select(self, question, top_k_tables=TOP_K_TABLES, token_budget=SCHEMA_TOKEN_BUDGET):
+        """Schema text for the top-k tables, their join keys and best columns, within the token budget."""
+        scores = self.index.scores(question)
+        if not scores.any():
+            # Nothing matched, so pruning would only guess; fall back to the full schema
+            return "".join(self.entries)
+
+        ranked = pd.DataFrame({"table": self.tables, "score": scores}).sort_values("score", ascending=False, kind="stable")
+        # A table ranks by its best column, with its next best columns as a tie-breaker
+        table_scores = ranked.groupby("table", sort=False)["score"].apply(
+            lambda s: s.iloc[0] + 0.25 * s.iloc[1:COLUMNS_PER_TABLE_SCORE].sum())
+        selected = self._bridge(set(table_scores[table_scores > 0].nlargest(top_k_tables).index))
+
+        joins = [key for key in self.join_keys if key[0][0] in selected and key[1][0] in selected]
+        join_rows = [self._row_of[column] for key in joins for column in key]
+        candidates = [i for i in ranked.index if self.tables[i] in selected]
+
+        rows = list(dict.fromkeys(join_rows))
+        used = int(self.entry_tokens[rows].sum()) if rows else 0
+        for i in candidates:
+            if i in rows:
+                continue
+            if used + self.entry_tokens[i] > token_budget:
+                break
+            rows.append(i)
+            used += int(self.entry_tokens[i])
+
+        text = "".join(self.entries[i] for i in sorted(rows))
+        if joins:
+            text += "Join keys:\n" + "".join(f"{a[0]}.{a[1]} = {b[0]}.{b[1]}\n" for a, b in joins)
+        return text
+
+
+def get_schema_index():
+    """Return the schema index, rebuilt only when Schema.csv or Examples.csv change."""
+    global _index
+    schema_block = get_schema_block()
+    examples_block = get_examples_block()
+    with _index_lock:
+        if _index is None or _index[0] is not schema_block or _index[1] is not examples_block:
+            _index = (schema_block, examples_block, SchemaIndex(schema_block.frame, examples_block.frame))
+        return _index[2]
+
+
+def relevant_schema_info(question, top_k_tables=TOP_K_TABLES, token_budget=SCHEMA_TOKEN_BUDGET):
+    return get_schema_index().select(question, top_k_tables=top_k_tables, token_budget=token_budget)
@@ -0,0 +1,186 @@
+import difflib
+import logging
+import os
+import re
+import time
+
+from prompt_context import get_schema_block
+from result_cache import normalize_sql
+
+# Corrections tried per question, and the wall-clock budget they share
+MAX_REPAIR_ATTEMPTS = int(os.environ.get("DBAGENT_REPAIR_ATTEMPTS", 3))
+REPAIR_DEADLINE_SECONDS = float(os.environ.get("DBAGENT_REPAIR_SECONDS", 90))
+SCHEMA_MATCHES = 5
+# Shortest run a correction is given; with less budget left the loop stops instead
+MIN_RUN_SECONDS = 5
+# Failures a corrected query cannot help with (QueryError kinds)
+UNREPAIRABLE = {"timeout": "query timed out", "cancelled": "query cancelled"}
+
+logger = logging.getLogger("dbagent.repair")
+
+# Snowflake errors read like "002003 (42S02): SQL compilation error:\nObject 'X' does not exist ..."
+_CODE_RE = re.compile(r"\b(\d{6})\s*\((\w{5})\)")
+_IDENTIFIER_RES = [
+    re.compile(r"invalid identifier '([^']+)'", re.I),
+    re.compile(r"Object '([^']+)' does not exist", re.I),
+    re.compile(r"(?:Table|Column) '([^']+)' (?:is not in|does not exist)", re.I),
+    re.compile(r"unexpected '([^']+)'", re.I),
+]
+# Positions change from one attempt to the next even when the failure is the same
+_POSITION_RE = re.compile(r"(?:line|position|column)\s+\d+", re.I)
+
+
+def parse_error(error):
+    """Error code, SQLSTATE, offending identifier and first message line of a Snowflake error."""
+    text = str(error)
+    code = _CODE_RE.search(text)
+    identifier = None
+    for pattern in _IDENTIFIER_RES:
+        match = pattern.search(text)
+        if match:
+            identifier = match.group(1)
+            break
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return {
+        "code": code.group(1) if code else None,
+        "sqlstate": code.group(2) if code else None,
+        "identifier": identifier,
+        "message": " ".join(lines[:3]),
+    }
+
+
+def error_signature(error):
+    """What stays the same when the same mistake is made again."""
+    parsed = parse_error(error)
+    message = _POSITION_RE.sub("", parsed["message"]).upper()
+    return parsed["code"], (parsed["identifier"] or "").upper(), message
+
+
+def nearest_schema_matches(identifier, schema_df=None, n=SCHEMA_MATCHES):
+    """Schema tables and TABLE.column names closest to a misspelt identifier."""
+    if not identifier:
+        return []
+    if schema_df is None:
+        schema_df = get_schema_block().frame
+    candidates = {}
+    for table, column in zip(schema_df["Table Name"].astype(str), schema_df["Column Name"].astype(str)):
+        short_table = table.split(".")[-1]
+        candidates.setdefault(short_table.upper(), table)
+        candidates.setdefault(column.upper(), f"{short_table}.{column}")
+        candidates.setdefault(f"{short_table}.{column}".upper(), f"{short_table}.{column}")
+    # Aliases and quoting are not part of the schema names
+    name = identifier.strip('"').upper()
+    probes = {name, name.split(".")[-1]}
+    matches = []
+    for probe in probes:
+        matches.extend(difflib.get_close_matches(probe, list(candidates), n=n, cutoff=0.5))
+    return list(dict.fromkeys(candidates[m] for m in matches))[:n]
+
+
+def error_kind(error):
+    """QueryError kind of a failure; plain error text counts as a warehouse error."""
+    return getattr(error, "kind", "error")
+
+
+def repair_feedback(error, schema_df=None):
+    """Structured description of a failure for the correction prompt."""
+    if error_kind(error) == "rejected":
+        # Nothing is wrong with the SQL itself; it reads too much
+        return (f"The query was not run because it would scan too much data.\n{error}\n"
+                "Keep the same meaning but narrow the scan: filter on a date column, "
+                "select fewer columns or aggregate earlier.")
+    parsed = parse_error(error)
+    lines = []
+    if parsed["code"]:
+        lines.append(f"Error code: {parsed['code']} (SQLSTATE {parsed['sqlstate']})")
+    lines.append(f"Message: {parsed['message']}")
+    if parsed["identifier"]:
+        lines.append(f"Offending identifier: {parsed['identifier']}")
+        matches = nearest_schema_matches(parsed["identifier"], schema_df)
+        if matches:
+            lines.append("Closest schema matches: " + ", ".join(matches))
+    return "\n".join(lines)
+
+
+class RepairOutcome:
+    """Last SQL tried, its result, and a record of every attempt."""
+
+    def __init__(self, sql, result, attempts, stopped_because):
+        self.sql = sql
+        self.result = result
+        self.attempts = attempts
+        self.stopped_because = stopped_because
+
+    @property
+    def succeeded(self):
+        return self.stopped_because == "succeeded"
+
+    def summary(self):
+        seconds = sum(a["fix_seconds"] + a["run_seconds"] for a in self.attempts)
+        return f"{len(self.attempts)} correction attempt(s) in {seconds:.1f}s: {self.stopped_because}"
+
+
+def _failed(result):
+    # execute_query returns the error text instead of raising
+    return isinstance(result, str)
+
+
+def repair_query(sql, error, fix, execute, failed=_failed, max_attempts=MAX_REPAIR_ATTEMPTS,
+                 deadline_seconds=REPAIR_DEADLINE_SECONDS):
+    """Correct and re-run a failed query until it works or the attempt/time budget is spent.
+
+    fix(sql, feedback) returns corrected SQL and execute(sql, timeout=seconds)
+    its result; each run is given only what is left of the deadline. The loop
+    also stops when a correction repeats an earlier statement or fails in the
+    same way as an earlier attempt, since another round would not help.
+    Timeouts and cancellations are never sent for correction.
+    """
+    started = time.monotonic()
+    if error_kind(error) in UNREPAIRABLE:
+        return RepairOutcome(sql, error, [], UNREPAIRABLE[error_kind(error)])
+    tried = {normalize_sql(sql)}
+    seen_errors = {error_signature(error)}
+    attempts = []
+    result = error
+    stopped_because = "attempt budget spent"
+    for number in range(1, max_attempts + 1):
+        if deadline_seconds - (time.monotonic() - started) < MIN_RUN_SECONDS:
+            stopped_because = "deadline reached"
+            break
+        fix_started = time.monotonic()
+        corrected = fix(sql, repair_feedback(result))
+        fix_seconds = time.monotonic() - fix_started
+        if normalize_sql(corrected) in tried:
+            attempts.append({"attempt": number, "sql": corrected, "error": "repeated an earlier statement",
+                             "fix_seconds": fix_seconds, "run_seconds": 0.0})
+            logger.info("repair attempt %d repeated an earlier statement (fix %.2fs)", number, fix_seconds)
+            stopped_because = "correction repeated an earlier statement"
+            break
+        tried.add(normalize_sql(corrected))
+        sql = corrected
+        remaining = deadline_seconds - (time.monotonic() - started)
+        if remaining < MIN_RUN_SECONDS:
+            attempts.append({"attempt": number, "sql": sql, "error": "not run: deadline reached",
+                             "fix_seconds": fix_seconds, "run_seconds": 0.0})
+            stopped_because = "deadline reached"
+            break
+        run_started = time.monotonic()
+        result = execute(sql, timeout=remaining)
+        run_seconds = time.monotonic() - run_started
+        error_text = str(result) if failed(result) else None
+        attempts.append({"attempt": number, "sql": sql, "error": error_text,
+                         "fix_seconds": fix_seconds, "run_seconds": run_seconds})
+        logger.info("repair attempt %d %s (fix %.2fs, run %.2fs)", number,
+                    "failed: " + error_text[:200] if error_text else "succeeded", fix_seconds, run_seconds)
+        if error_text is None:
+            stopped_because = "succeeded"
+            break
+        if error_kind(result) in UNREPAIRABLE:
+            stopped_because = UNREPAIRABLE[error_kind(result)]
+            break
+        signature = error_signature(result)
+        if signature in seen_errors:
+            stopped_because = "same error repeated"
+            break
+        seen_errors.add(signature)
+    return RepairOutcome(sql, result, attempts, stopped_because)
@@ -0,0 +1,192 @@
+import threading
+
+from cost_guard import referenced_tables
+from prompt_context import get_examples_block, get_schema_block
+from schema_retrieval import find_join_keys, match_table
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:
+    sqlglot = None
+
+DIALECT = "snowflake"
+# Prefix the agents already route to the error-correction prompt
+ERROR_PREFIX = "SQL compilation error (checked locally):"
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+class ValidationResult:
+    """Problems found in a statement: errors stop it from running, warnings do not."""
+
+    def __init__(self, errors=None, warnings=None):
+        self.errors = errors or []
+        self.warnings = warnings or []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def message(self):
+        text = ERROR_PREFIX + " " + " ".join(dict.fromkeys(self.errors))
+        if self.warnings:
+            # The correction prompt sees the suspicious joins as well
+            text += " Also check: " + " ".join(dict.fromkeys(self.warnings))
+        return text
+
+    def warning(self):
+        return " ".join(dict.fromkeys(self.warnings))
+
+
+def example_tables(examples_df):
+    """Tables the Examples.csv queries read."""
+    return list(dict.fromkeys(name for sql in examples_df["Query"].dropna().astype(str)
+                              for name in referenced_tables(sql)))
+
+
+class SqlValidator:
+    """Checks table, column and join references of a statement against the Schema.csv catalog.
+
+    known_tables (those the examples read) are accepted even when Schema.csv
+    does not list them; their columns are not checked.
+    """
+
+    def __init__(self, schema_df, join_keys=(), known_tables=()):
+        self.columns = {}
+        for table, column in zip(schema_df["Table Name"].astype(str), schema_df["Column Name"].astype(str)):
+            self.columns.setdefault(table, set()).add(column.upper())
+        self.tables = list(self.columns) + [table for table in known_tables
+                                            if match_table(table, list(self.columns)) is None]
+        self.join_keys = {frozenset([(left, a.upper()), (right, b.upper())]) for (left, a), (right, b) in join_keys}
+
+    def _table_name(self, table):
+        return ".".join(part for part in (table.catalog, table.db, table.name) if part)
+
+    def _resolve(self, table):
+        # Table functions such as FLATTEN have no name and are not in the catalog
+        if not table.name:
+            return None
+        return match_table(self._table_name(table), self.tables)
+
+    def validate(self, sql):
+        if sqlglot is None:
+            return ValidationResult()
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=DIALECT) if s is not None]
+        except ParseError as e:
+            detail = e.errors[0] if e.errors else {}
+            where = f" at line {detail['line']}, column {detail['col']}" if "line" in detail else ""
+            return ValidationResult([f"Syntax error{where}: {detail.get('description', str(e))}."])
+
+        result = ValidationResult()
+        for statement in statements:
+            self._check_tables(statement, result)
+            try:
+                scopes = traverse_scope(statement)
+            except Exception:
+                # Constructs the scope analysis does not understand are left to Snowflake
+                continue
+            for scope in scopes:
+                # Union scopes hold no columns of their own; their SELECTs are scopes too
+                if isinstance(scope.expression, exp.Select):
+                    self._check_columns(scope, result)
+                    self._check_joins(scope, result)
+        return result
+
+    def _check_tables(self, statement, result):
+        ctes = {cte.alias_or_name.upper() for cte in statement.find_all(exp.CTE)}
+        for table in statement.find_all(exp.Table):
+            if not table.name or table.name.upper() in ctes:
+                continue
+            if self._resolve(table) is None:
+                result.errors.append(f"Table '{self._table_name(table)}' is not in the schema.")
+
+    def _catalog_table(self, source):
+        # Derived tables, CTEs (scopes) and tables known only from the examples have no column list
+        table = self._resolve(source) if isinstance(source, exp.Table) else None
+        return table if table in self.columns else None
+
+    def _sources(self, scope):
+        return {name.upper(): self._catalog_table(source) for name, source in scope.sources.items()}
+
+    def _visible_sources(self, scope):
+        # A correlated subquery may also name the tables of every enclosing query
+        sources = {}
+        while scope is not None:
+            for name, table in self._sources(scope).items():
+                sources.setdefault(name, table)
+            scope = scope.parent
+        return sources
+
+    def _check_columns(self, scope, result):
+        select = scope.expression
+        sources = self._sources(scope)
+        visible = self._visible_sources(scope)
+        aliases = {s.alias.upper() for s in select.selects if isinstance(s, exp.Alias)}
+
+        for column in scope.columns:
+            # Columns of a subquery in WHERE or SELECT are checked with that subquery's own scope
+            if column.find_ancestor(exp.Select) is not select:
+                continue
+            name = column.name.upper()
+            if not name or name == "*":
+                continue
+            if column.table:
+                table = visible.get(column.table.upper())
+                if table is not None and name not in self.columns[table]:
+                    result.errors.append(f"Column '{column.name}' does not exist in table '{table}'.")
+            elif sources and all(visible.values()) and name not in aliases:
+                if not any(name in self.columns[table] for table in visible.values()):
+                    tables = ", ".join(sorted(set(sources.values())))
+                    result.errors.append(f"Column '{column.name}' does not exist in {tables}.")
+
+    def _check_joins(self, scope, result):
+        if not self.join_keys:
+            return
+        sources = {name: table for name, table in self._sources(scope).items() if table is not None}
+        for join in scope.expression.args.get("joins") or []:
+            condition = join.args.get("on")
+            if condition is None:
+                continue
+            for eq in condition.find_all(exp.EQ):
+                left, right = eq.this, eq.expression
+                if not isinstance(left, exp.Column) or not isinstance(right, exp.Column):
+                    continue
+                left_table = sources.get(left.table.upper()) if left.table else None
+                right_table = sources.get(right.table.upper()) if right.table else None
+                if left_table is None or right_table is None or left_table == right_table:
+                    continue
+                pair = frozenset([(left_table, left.name.upper()), (right_table, right.name.upper())])
+                if pair not in self.join_keys:
+                    result.warnings.append(
+                        f"Join {left_table}.{left.name} = {right_table}.{right.name} is not a known join key.")
+
+
+def get_sql_validator():
+    """Return the validator, rebuilt only when Schema.csv or Examples.csv change."""
+    global _validator
+    schema_block = get_schema_block()
+    examples_block = get_examples_block()
+    with _validator_lock:
+        if _validator is None or _validator[0] is not schema_block or _validator[1] is not examples_block:
+            _validator = (schema_block, examples_block,
+                          SqlValidator(schema_block.frame, find_join_keys(schema_block.frame, examples_block.frame),
+                                       example_tables(examples_block.frame)))
+        return _validator[2]
+
+
+def validate_sql(sql):
+    """ValidationResult for a statement; empty when sqlglot is not installed."""
+    if sqlglot is None:
+        return ValidationResult()
+    return get_sql_validator().validate(sql)
+
+
+def validation_error(sql):
+    """Error text for a statement that would fail to compile, or None when it looks runnable."""
+    result = validate_sql(sql)
+    return None if result.ok else result.message()
@@ -1,12 +1,12 @@
-import pandas as pd
 import openai
 import streamlit as st
 import os
+from conversation_memory import build_conversation
+from llm_cache import chat_completion
+from prompt_budget import PromptSection, fit_prompt
 import plotly.express as px
-import tiktoken
 import re
-from pyairtable import Table
-from google.cloud import bigquery
+from airtable_schema import get_schema_snapshot
 from plotly.subplots import make_subplots
 import plotly.graph_objs as go
 
@@ -19,58 +19,52 @@ openai.api_key = st.secrets.credentials.api_key
 personal_access_token = st.secrets.credentials.airtable_pat
 base_id = 'app4ZQ9jav2XzNIv9'  # Airtable base ID
 schema_table_id = 'tbl87TPsWhnxSnWw8'  # Airtable table ID for BQNewSchemaColumn
-bigquery_credentials_path = "rudderevents-d409acb5f033.json"  # Path to your BigQuery credentials JSON file
-bigquery_project_id = "rudderevents"  # Your Google Cloud project ID
-
-# Initialize BigQuery client
-bigquery_client = bigquery.Client.from_service_account_json(bigquery_credentials_path)
 
 def load_data(personal_access_token, base_id, schema_table_id):
-    """Load active schema data from Airtable."""
-    schema_table = Table(personal_access_token, base_id, schema_table_id)
-    schema_records = schema_table.all()
-    schema_df = pd.DataFrame([record['fields'] for record in schema_records])
-    return schema_df
+    """Schema table from the local Airtable snapshot, kept in sync in the background."""
+    return get_schema_snapshot(personal_access_token, base_id, schema_table_id)
 
 def prepare_schema_info(schema_df):
     """Prepare schema information from DataFrame with only active columns."""
-    active_schema_df = schema_df[schema_df['Status'].str.lower() == 'active']
-    schema_info = ""
-
-    for _, row in active_schema_df.iterrows():
-        schema_info += (
-            f"Schema: {row['Schema Name']}\n"
-            f"Table: {row['Table Name']}\n"
-            f"Column: {row['Column Name']}\n\n"
-        )
-
+    active_schema_df = schema_df[schema_df['Status'].astype(str).str.lower() == 'active']
+    schema_info = "".join(
+        "Schema: " + active_schema_df['Schema Name'].astype(str)
+        + "\nTable: " + active_schema_df['Table Name'].astype(str)
+        + "\nColumn: " + active_schema_df['Column Name'].astype(str) + "\n\n"
+    )
     return schema_info, active_schema_df
 
 def generate_pseudocode(conversation, schema_info, active_schema_df):
     """Generate step-wise pseudocode for SQL generation."""
+    system_prompt = "You are a Query Expert who generates step-wise instructions for SQL Query generation. Keep it short and accurate. Don't give SQL Query in response."
+    sections = fit_prompt("gpt-4o", [
+        PromptSection("schema", schema_info, priority=2),
+        PromptSection("conversation", conversation, priority=1, keep="tail"),
+    ], fixed_text=system_prompt, max_output_tokens=2000)
     prompt = f"""
     You are an expert at generating step-wise instructions for SQL generation. Given the active schema information below, generate human-readable instructions for the given user query in steps. 
     Ensure the pseudocode makes sense of the schema, table, and column names. If a required column, table, or schema is missing from the schema, table or column list, mention this in the pseudocode, don't generate false pseudocode.
     Schema Information:
-    {schema_info}
+    {sections['schema']}
     Conversation:
-    {conversation}
+    {sections['conversation']}
     """
-    response = openai.chat.completions.create(
+    response = chat_completion(
+        openai,
         model="gpt-4o",
         messages=[
-            {"role": "system", "content": "You are a Query Expert who generates step-wise instructions for SQL Query generation. Keep it short and accurate. Don't give SQL Query in response."},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ],
         max_tokens=2000,
         temperature=0.1
     )
-    return response.choices[0].message.content.strip()
+    return response.strip()
 
 
-# Load schema from Airtable once when the application starts
-schema_df = load_data(personal_access_token, base_id, schema_table_id)
-schema_info, active_schema_df = prepare_schema_info(schema_df)
+# Schema info is rebuilt only when the snapshot changes, not on every rerun
+schema_snapshot = load_data(personal_access_token, base_id, schema_table_id)
+schema_info, active_schema_df = schema_snapshot.derived(prepare_schema_info)
 
 st.title("BI Automation")
 
@@ -78,7 +72,7 @@ st.title("BI Automation")
 user_question = st.text_input("Define your Marketing Analytics Requirements:")
 if st.button("Send"):
     if user_question:
-        conversation = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
+        conversation = build_conversation(st.session_state.messages)
         pseudocode = generate_pseudocode(conversation + f"\nUser: {user_question}", schema_info, active_schema_df)
         st.session_state.messages.append({"role": "user", "content": user_question})
         st.session_state.messages.append({"role": "assistant", "content": pseudocode})
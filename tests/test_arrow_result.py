@@ -0,0 +1,45 @@
+import pyarrow as pa
+
+from arrow_result import PagedResult, chart_frame
+
+
+class _Batch:
+    def __init__(self, start, rows):
+        self.rowcount = rows
+        self._table = pa.table({"n": list(range(start, start + rows))})
+
+    def to_arrow(self):
+        return self._table
+
+
+def _paged(batches=5, rows=100, **kwargs):
+    empty = pa.table({"n": pa.array([], pa.int64())})
+    return PagedResult([_Batch(i * rows, rows) for i in range(batches)], empty, page_rows=rows, **kwargs)
+
+
+def test_first_page_only_until_asked():
+    result = _paged()
+    assert len(result) == 100 and not result.complete
+
+
+def test_chart_frame_loads_the_whole_result():
+    result = _paged()
+    assert len(chart_frame(result)) == 500
+    assert result.complete and not result.capped
+
+
+def test_chart_frame_stops_at_the_row_cap():
+    result = _paged(max_rows=250)
+    assert len(chart_frame(result)) == 250
+    assert result.capped
+
+
+def test_on_complete_runs_once_when_the_last_page_loads():
+    result = _paged()
+    seen = []
+    result.on_complete = seen.append
+    result.load_more()
+    assert seen == []
+    result.load_all()
+    result.load_all()
+    assert seen == [result]
@@ -0,0 +1,32 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("plotly")
+
+from chart_engine import likely_chartable, recommend_chart
+from data_profile import column_roles
+
+
+def _funnel_counts(funnels):
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(5)]
+    return pd.DataFrame([(day, funnel, 10 + funnel) for day in days for funnel in range(1, funnels + 1)],
+                        columns=["DATE", "CLICKFUNNEL_ID", "COUNT"])
+
+
+def test_integer_ids_are_dimensions():
+    dates, dimensions, metrics = column_roles(_funnel_counts(3))
+    assert (dates, dimensions, metrics) == (["DATE"], ["CLICKFUNNEL_ID"], ["COUNT"])
+    assert column_roles(pd.DataFrame({"PAID": [1, 2], "VALID_COUNT": [3, 4]}))[2] == ["PAID", "VALID_COUNT"]
+
+
+def test_few_ids_are_drawn_as_one_line_each():
+    fig = recommend_chart(_funnel_counts(3))
+    assert len(fig.data) == 3 and fig.layout.title.text == "COUNT over DATE by CLICKFUNNEL_ID"
+
+
+def test_many_ids_are_left_to_the_llm():
+    df = _funnel_counts(40)
+    assert likely_chartable(df.head(0))
+    assert recommend_chart(df) is None
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+from chat_history import HistoryStore
+
+
+def test_failed_reload_is_not_retried():
+    history = HistoryStore(max_frames=0)
+    turn = history.add("How many deals?", "SELECT COUNT(*) FROM deals", "warehouse unavailable")
+    turn.error = None  # as if it had succeeded and its frame was since evicted
+    calls = []
+
+    def load(sql):
+        calls.append(sql)
+        return "Object 'DEALS' does not exist"
+
+    assert history.result(turn, load) is None
+    assert history.result(turn, load) is None
+    assert history.figure(turn, load) is None
+    assert calls == ["SELECT COUNT(*) FROM deals"]
+    assert "DEALS" in turn.error
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool, PoolTimeout
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        self.conn.pings += 1
+        time.sleep(self.conn.ping_seconds)
+        if self.conn.broken:
+            raise ConnectionError("connection reset")
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class _Connection:
+    def __init__(self, ping_seconds):
+        self.ping_seconds = ping_seconds
+        self.pings = 0
+        self.broken = False
+        self.closed = False
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class _Connector:
+    def __init__(self, ping_seconds=0):
+        self.ping_seconds = ping_seconds
+        self.opened = []
+
+    def __call__(self, **params):
+        conn = _Connection(self.ping_seconds)
+        self.opened.append(conn)
+        return conn
+
+
+def _pool(connector, **options):
+    return ConnectionPool({"account": "test"}, connect=connector, session_parameters={}, **options)
+
+
+def test_pool_never_opens_more_than_its_size():
+    connector = _Connector()
+    pool = _pool(connector, size=2, checkout_timeout=0.05)
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert len(connector.opened) == 2
+    pool.release(first)
+    assert pool.acquire() is first
+
+
+def test_checkout_waits_for_a_returned_connection():
+    pool = _pool(_Connector(), size=1, checkout_timeout=5)
+    held = pool.acquire()
+    threading.Timer(0.05, pool.release, [held]).start()
+    assert pool.acquire() is held
+
+
+def test_idle_and_old_connections_are_recycled():
+    connector = _Connector()
+    pool = _pool(connector, idle_timeout=0.05)
+    with pool.connection() as conn:
+        pass
+    time.sleep(0.1)
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed and pool.stats["recycled"] == 1
+
+    pool = _pool(connector, max_lifetime=0)
+    with pool.connection() as conn:
+        pass
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed
+
+
+def test_failed_connection_is_pinged_and_discarded():
+    connector = _Connector()
+    pool = _pool(connector)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.broken = True
+            raise RuntimeError("query failed")
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.pings == 1 and conn.closed
+    assert pool.stats["discarded"] == 1 and pool._open_count == 1
+
+
+def test_closed_connection_is_not_returned_to_the_pool():
+    pool = _pool(_Connector())
+    with pool.connection() as conn:
+        conn.close()
+    assert not pool._idle and pool._open_count == 0
+
+
+def test_health_checks_run_in_parallel():
+    # Every checkout pings; the pings must not queue behind one another on the pool lock
+    pool = _pool(_Connector(ping_seconds=0.3), size=2, health_check_after=0)
+    for conn in [pool.acquire(), pool.acquire()]:
+        pool.release(conn)
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda: pool.release(pool.acquire())) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started < 0.5
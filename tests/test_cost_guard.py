@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("sqlglot")
+
+from arrow_result import PREVIEW_ROWS
+from cost_guard import CostGuard, LocalPlanner, add_date_filter
+
+GB = 1024 ** 3
+DEALS = "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_DEALS"
+SHEET = "RUDDER_EVENTS.G_SHEET_FUNNEL_MAPPING.RUDDER_SHEET_1"
+
+
+@pytest.fixture
+def planner():
+    # DEALS has a date column the guard can filter on; SHEET does not
+    return LocalPlanner({DEALS: (1000, 200 * GB), SHEET: (1000, 150 * GB)})
+
+
+@pytest.fixture
+def guard():
+    return CostGuard(warn_bytes=10 * GB, max_bytes=100 * GB, lookback_days=90)
+
+
+def test_small_query_runs_unchanged(guard):
+    planner = LocalPlanner({DEALS: (10, 1 * GB)})
+    sql = f"SELECT COUNT(*) FROM {DEALS}"
+    decision = guard.check(sql, planner.explain)
+    assert decision.sql == sql and not decision.notes and not decision.rejected
+
+
+def test_large_query_under_the_limit_warns(guard):
+    # The date filter reads a tenth of the table: 50 GB
+    planner = LocalPlanner({DEALS: (1000, 500 * GB)})
+    sql = f"SELECT COUNT(*) FROM {DEALS} WHERE properties_closedate >= '2024-01-01'"
+    decision = guard.check(sql, planner.explain)
+    assert not decision.rejected
+    assert decision.sql == sql
+    assert "would scan" in decision.message()
+
+
+def test_full_scan_is_narrowed_to_a_recent_window(guard, planner):
+    decision = guard.check(f"SELECT COUNT(*) FROM {DEALS}", planner.explain)
+    assert not decision.rejected
+    assert "properties_closedate >= DATEADD(DAY, -90" in decision.sql
+    assert "last 90 days" in decision.message()
+
+
+def test_row_level_query_gets_a_limit(guard, planner):
+    decision = guard.check(f"SELECT properties_email FROM {DEALS}", planner.explain)
+    assert not decision.rejected
+    assert decision.sql.endswith(f"LIMIT {PREVIEW_ROWS}")
+    assert "Returning the first" in decision.message()
+
+
+def test_query_that_cannot_be_narrowed_is_rejected(guard, planner):
+    decision = guard.check(f"SELECT COUNT(*) FROM {SHEET}", planner.explain)
+    assert decision.rejected
+    assert "not run" in decision.message()
+
+
+def test_existing_date_filter_is_left_alone():
+    assert add_date_filter(f"SELECT COUNT(*) FROM {DEALS} WHERE properties_closedate > '2024-01-01'") is None
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+import llm_stream
+from llm_cache import CompletionCache
+from query_pipeline import bare_sql_statement_end, sql_statement_end
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Here is the query; it counts deals.\nGenerated SQL Query: SELECT 1;", "Generated SQL Query: SELECT 1;"),
+    ("Generated SQL Query: SELECT /* a; b */ 1; trailing", "Generated SQL Query: SELECT /* a; b */ 1;"),
+    ("Generated SQL Query: SELECT ';' AS s, 2; trailing", "Generated SQL Query: SELECT ';' AS s, 2;"),
+    ("Generated SQL Query: SELECT 1 -- a; b\nFROM t; trailing", "Generated SQL Query: SELECT 1 -- a; b\nFROM t;"),
+    ("Sure:\n```sql\nSELECT 1;\n```\nmore", "Sure:\n```sql\nSELECT 1;\n```"),
+])
+def test_statement_end(text, expected):
+    assert text[:sql_statement_end(text)].endswith(expected)
+
+
+@pytest.mark.parametrize("text", [
+    "Here is the query; it counts deals.",
+    "Generated SQL Query: SELECT /* a; b",
+    "Generated SQL Query: SELECT 1 -- not yet;",
+    "Generated SQL Query: SELECT 'a;",
+])
+def test_statement_still_arriving(text):
+    assert sql_statement_end(text) is None
+
+
+def test_bare_statement_needs_no_marker():
+    assert bare_sql_statement_end("SELECT 1; trailing") == len("SELECT 1;")
+    assert bare_sql_statement_end("Here is the query; SELECT 1;") is None
+
+
+def _client(pieces):
+    chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))]) for p in pieces]
+    create = lambda **kwargs: iter(chunks)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = CompletionCache(path=str(tmp_path / "llm.sqlite3"))
+    monkeypatch.setattr(llm_stream, "get_completion_cache", lambda: cache)
+    return cache
+
+
+def test_stopped_answer_is_cached(cache):
+    client = _client(["Here is the query;", " it counts deals.\nGenerated SQL Query: SELECT", " 1;", " -- done"])
+    messages = [{"role": "user", "content": "q"}]
+    text = llm_stream.stream_chat_completion(client, stop_at=sql_statement_end, model="m", messages=messages)
+    assert text.endswith("Generated SQL Query: SELECT 1;")
+    assert cache._lookup(cache.key("m", messages, {})) == text
+
+
+def test_cut_before_an_answer_is_not_cached(cache):
+    # The kept text is not itself a complete answer, so it must not be served for a week
+    client = _client(["Here is the query;", " more prose"])
+    messages = [{"role": "user", "content": "q"}]
+    before_more = lambda text: text.find(" more") if " more" in text else None
+    text = llm_stream.stream_chat_completion(client, stop_at=before_more, model="m", messages=messages)
+    assert text == "Here is the query;"
+    assert cache._lookup(cache.key("m", messages, {})) is None
+
+
+def test_unstopped_response_is_cached(cache):
+    client = _client(["No SQL; ", "just prose"])
+    messages = [{"role": "user", "content": "q"}]
+    text = llm_stream.stream_chat_completion(client, stop_at=sql_statement_end, model="m", messages=messages)
+    assert text == "No SQL; just prose"
+    assert cache._lookup(cache.key("m", messages, {})) == text
@@ -0,0 +1,20 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import query_pipeline
+from query_pipeline import start_query
+
+
+def test_queue_wait_does_not_count_toward_the_timeout(monkeypatch):
+    monkeypatch.setattr(query_pipeline, "_query_executor", ThreadPoolExecutor(max_workers=1))
+    release = threading.Event()
+    first = start_query("SELECT 1", lambda sql, progress: release.wait(5))
+    second = start_query("SELECT 2", lambda sql, progress: progress.elapsed)
+    time.sleep(0.3)
+    assert second.progress.queued
+    assert second.progress.describe() == "Waiting for a free worker"
+    release.set()
+    assert first.result(5)
+    assert second.result(5) < 0.3
+    assert not second.progress.queued
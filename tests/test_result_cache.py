@@ -0,0 +1,24 @@
+import pytest
+
+from result_cache import has_row_limit, with_limit
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("select * from t where a = '--x'", "select * from t where a = '--x'\nLIMIT 10"),
+    ("select * from t where a = 'x;'", "select * from t where a = 'x;'\nLIMIT 10"),
+    ("select 1 from t; -- done\n", "select 1 from t\nLIMIT 10"),
+    ("select 1 from t /* a; b */ ;\n", "select 1 from t\nLIMIT 10"),
+    ('select "a--b" from t', 'select "a--b" from t\nLIMIT 10'),
+])
+def test_with_limit_strips_only_the_trailer(sql, expected):
+    assert with_limit(sql, 10) == expected
+
+
+def test_with_limit_keeps_existing_limit():
+    sql = "select * from t limit 5;"
+    assert has_row_limit(sql)
+    assert with_limit(sql, 10) == sql
+
+
+def test_with_limit_ignores_other_statements():
+    assert with_limit("show tables", 10) == "show tables"
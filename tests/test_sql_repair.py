@@ -0,0 +1,50 @@
+from query_pipeline import QueryError
+from sql_repair import repair_feedback, repair_query
+
+COMPILE_ERROR = QueryError("002003 (42S02): SQL compilation error:\nObject 'DEALZ' does not exist or not authorized.")
+
+
+def test_each_run_gets_only_the_time_left(monkeypatch):
+    timeouts = []
+
+    def execute(sql, timeout):
+        timeouts.append(timeout)
+        return QueryError(f"000904 (42000): SQL compilation error: invalid identifier 'X{len(timeouts)}'")
+
+    repair_query("SELECT x0 FROM deals", COMPILE_ERROR, fix=lambda sql, feedback: f"SELECT x{len(timeouts) + 1} FROM deals",
+                 execute=execute, deadline_seconds=60)
+    assert len(timeouts) == 3
+    assert all(t <= 60 for t in timeouts) and timeouts == sorted(timeouts, reverse=True)
+
+
+def test_timeout_is_not_sent_for_correction():
+    fixes = []
+    outcome = repair_query("SELECT 1", QueryError("Query ran longer than 300s and was cancelled.", "timeout"),
+                           fix=lambda sql, feedback: fixes.append(sql) or "SELECT 2",
+                           execute=lambda sql, timeout: None)
+    assert fixes == [] and outcome.stopped_because == "query timed out"
+
+
+def test_loop_stops_when_a_correction_times_out():
+    fixes = []
+
+    def fix(sql, feedback):
+        fixes.append(feedback)
+        return f"SELECT {len(fixes)}"
+
+    outcome = repair_query("SELECT 0", COMPILE_ERROR, fix=fix,
+                           execute=lambda sql, timeout: QueryError("Query ran longer than 5s.", "timeout"))
+    assert len(fixes) == 1 and outcome.stopped_because == "query timed out"
+
+
+def test_too_little_budget_left_stops_before_running():
+    ran = []
+    outcome = repair_query("SELECT 0", COMPILE_ERROR, fix=lambda sql, feedback: "SELECT 1",
+                           execute=lambda sql, timeout: ran.append(sql), deadline_seconds=1)
+    assert ran == [] and outcome.stopped_because == "deadline reached"
+
+
+def test_rejection_feedback_asks_for_a_narrower_query():
+    feedback = repair_feedback(QueryError("Query rejected by the cost guard: This query would scan 200 GB.", "rejected"))
+    assert "not run because it would scan too much" in feedback
+    assert "Error code" not in feedback
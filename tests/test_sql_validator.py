@@ -0,0 +1,105 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("sqlglot")
+
+from conftest import ROOT
+from schema_retrieval import find_join_keys
+from sql_validator import SqlValidator, example_tables
+
+DEALS = "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_DEALS"
+CONTACTS = "RUDDER_EVENTS.HUBSPOT_DEV.HUBSPOT_DATA_RUDDER_CONTACTS"
+SHEET = "RUDDER_EVENTS.G_SHEET_FUNNEL_MAPPING.RUDDER_SHEET_1"
+
+schema_df = pd.read_csv(os.path.join(ROOT, "Schema.csv"))
+examples_df = pd.read_csv(os.path.join(ROOT, "Examples.csv"))
+
+
+@pytest.fixture(scope="module")
+def validator():
+    return SqlValidator(schema_df, find_join_keys(schema_df, examples_df), example_tables(examples_df))
+
+
+# Examples 3 and 6 have genuine syntax slips (a missing comma, two WHERE clauses)
+SYNTAX_SLIPS = {3, 6}
+
+
+@pytest.mark.parametrize("index", range(len(examples_df)))
+def test_examples_pass(validator, index):
+    result = validator.validate(examples_df["Query"][index])
+    if index in SYNTAX_SLIPS:
+        assert len(result.errors) == 1 and result.errors[0].startswith("Syntax error")
+    else:
+        assert result.errors == []
+
+
+def test_table_known_only_from_the_examples_is_accepted(validator):
+    sql = "SELECT anything FROM RUDDER_EVENTS.ADS_PERFORMANCE_LIBRARY.AP_LRUDDER_ADS"
+    assert validator.validate(sql).ok
+
+
+def test_select_list_column_is_checked(validator):
+    result = validator.validate(f"SELECT bogus_col FROM {DEALS}")
+    assert result.errors == [f"Column 'bogus_col' does not exist in {DEALS}."]
+
+
+def test_qualified_column_is_checked(validator):
+    result = validator.validate(f"SELECT d.nope FROM {DEALS} AS d")
+    assert result.errors == [f"Column 'nope' does not exist in table '{DEALS}'."]
+
+
+def test_unknown_table(validator):
+    result = validator.validate("SELECT 1 FROM RUDDER_EVENTS.HUBSPOT_DEV.NO_SUCH_TABLE")
+    assert not result.ok
+    assert "is not in the schema" in result.message()
+
+
+def test_syntax_error(validator):
+    result = validator.validate(f"SELECT properties_email FROM {DEALS} WHERE properties_amount > 0 WHERE 1 = 1")
+    assert result.errors and result.errors[0].startswith("Syntax error")
+
+
+def test_alias_may_be_referenced(validator):
+    result = validator.validate(f"SELECT properties_amount AS amount FROM {DEALS} ORDER BY amount")
+    assert result.ok
+
+
+def test_in_subquery_columns_use_their_own_table(validator):
+    sql = (f"SELECT properties_email FROM {DEALS} WHERE properties_email IN "
+           f"(SELECT properties_email FROM {CONTACTS} WHERE properties_clickfunnel_id IS NOT NULL)")
+    assert validator.validate(sql).ok
+
+
+def test_correlated_exists(validator):
+    sql = (f"SELECT a.properties_email FROM {DEALS} AS a WHERE EXISTS "
+           f"(SELECT 1 FROM {CONTACTS} AS c WHERE c.properties_email = a.properties_email)")
+    assert validator.validate(sql).ok
+
+
+def test_correlated_subquery_with_bad_column(validator):
+    sql = (f"SELECT a.properties_email FROM {DEALS} AS a WHERE EXISTS "
+           f"(SELECT 1 FROM {CONTACTS} AS c WHERE c.nope = a.properties_email)")
+    assert validator.validate(sql).errors == [f"Column 'nope' does not exist in table '{CONTACTS}'."]
+
+
+def test_unknown_join_key_is_reported(validator):
+    sql = f"SELECT a.properties_email FROM {DEALS} AS a JOIN {CONTACTS} AS c ON a.properties_amount = c.properties_email"
+    result = validator.validate(sql)
+    assert result.ok
+    assert result.warnings
+    assert "not a known join key" in result.warning()
+
+
+def test_known_join_key_is_not_reported(validator):
+    sql = (f"SELECT a.properties_email FROM {CONTACTS} AS a LEFT JOIN {SHEET} AS b "
+           "ON a.properties_clickfunnel_id = b.clickfunnel_id")
+    assert validator.validate(sql).warnings == []
+
+
+def test_warnings_reach_the_correction_prompt(validator):
+    sql = (f"SELECT a.bogus FROM {DEALS} AS a JOIN {CONTACTS} AS c "
+           "ON a.properties_amount = c.properties_email")
+    message = validator.validate(sql).message()
+    assert "bogus" in message and "not a known join key" in message
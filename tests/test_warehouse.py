@@ -0,0 +1,222 @@
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+
+import warehouse
+from arrow_result import ArrowResult, PagedResult, chart_frame
+from cost_guard import CostGuard, GuardDecision
+from query_pipeline import QueryTimeout
+from result_cache import ResultCache
+from warehouse import WarehouseBackend, execute_checked, snowflake_params
+
+DEFAULTS = {"user": "DATAINTEGRITY_KALIPER", "account": "jsgkebp-cn71497", "role": "RUDDER"}
+
+
+@pytest.fixture(autouse=True)
+def no_env(monkeypatch):
+    for key in ("USER", "PASSWORD", "ACCOUNT", "WAREHOUSE", "DATABASE", "ROLE"):
+        monkeypatch.delenv(f"DBAGENT_SNOWFLAKE_{key}", raising=False)
+
+
+def test_password_only_secrets_keep_the_agent_account():
+    params = snowflake_params({"credentials": {"sf_password": "p"}}, DEFAULTS)
+    assert params == dict(DEFAULTS, password="p")
+
+
+def test_secrets_section_overrides_defaults():
+    params = snowflake_params({"snowflake": {"account": "zt30947.us-east-2.aws", "password": "q"},
+                               "credentials": {"sf_password": "p"}}, DEFAULTS)
+    assert params["account"] == "zt30947.us-east-2.aws"
+    assert params["password"] == "q"
+    assert params["user"] == "DATAINTEGRITY_KALIPER"
+
+
+def test_environment_overrides_secrets(monkeypatch):
+    monkeypatch.setenv("DBAGENT_SNOWFLAKE_ROLE", "ANALYST")
+    assert snowflake_params({"snowflake": {"role": "RUDDER"}}, DEFAULTS)["role"] == "ANALYST"
+
+
+class _Backend(WarehouseBackend):
+    kind = "fake"
+    source_dialect = "duckdb"
+    namespace = "fake"
+
+    def __init__(self):
+        self.executed = []
+
+    def explain(self, sql):
+        raise NotImplementedError
+
+    def execute(self, sql, progress=None, timeout=None):
+        self.executed.append(sql)
+        return ArrowResult(pa.table({"n": [len(self.executed)]}))
+
+
+class _NarrowingGuard:
+    def check(self, sql, explain):
+        return GuardDecision(sql + " WHERE day >= CURRENT_DATE - 30", notes=["Narrowed to 30 days."])
+
+
+def test_narrowed_result_is_not_cached_as_the_original(tmp_path, monkeypatch):
+    cache = ResultCache(directory=str(tmp_path))
+    monkeypatch.setattr(warehouse, "get_result_cache", lambda: cache)
+    monkeypatch.setattr(warehouse, "get_cost_guard", lambda: _NarrowingGuard())
+    backend = _Backend()
+
+    execute_checked(backend, "SELECT n FROM t")
+    assert cache.get("SELECT n FROM t", namespace="fake") is None
+    assert cache.get("SELECT n FROM t WHERE day >= CURRENT_DATE - 30", namespace="fake") is not None
+
+    # The same question narrowed the same way is answered from the cache
+    notes = []
+    execute_checked(backend, "SELECT n FROM t", warn=notes.append)
+    assert backend.executed == ["SELECT n FROM t WHERE day >= CURRENT_DATE - 30"]
+    assert notes == ["Narrowed to 30 days."]
+
+
+class _PagedBackend(_Backend):
+    def execute(self, sql, progress=None, timeout=None):
+        table = pa.table({"n": list(range(300))})
+        batches = [warehouse._ArrowBatch(b) for b in table.to_batches(max_chunksize=100)]
+        return PagedResult(batches, table.slice(0, 0), page_rows=100)
+
+
+def test_paged_result_is_cached_once_fully_loaded(tmp_path, monkeypatch):
+    cache = ResultCache(directory=str(tmp_path))
+    monkeypatch.setattr(warehouse, "get_result_cache", lambda: cache)
+    monkeypatch.setattr(warehouse, "get_cost_guard", lambda: CostGuard())
+    result = execute_checked(_PagedBackend(), "SELECT n FROM t")
+    assert cache.get("SELECT n FROM t", namespace="fake") is None
+    assert len(chart_frame(result)) == 300
+    assert len(cache.get("SELECT n FROM t", namespace="fake")) == 300
+
+
+@pytest.fixture
+def duckdb_backend(tmp_path):
+    pytest.importorskip("duckdb")
+    import pyarrow.parquet as pq
+    directory = tmp_path / "RUDDER_EVENTS" / "HUBSPOT_DEV" / "DEALS"
+    directory.mkdir(parents=True)
+    # 2024-01-02 03:00 UTC is still January 1st in Los Angeles
+    pq.write_table(pa.table({"ID": [1, 2], "UUID_TS": pa.array([1704164400, 1704250800], pa.timestamp("s"))}),
+                   directory / "data.parquet")
+    return warehouse.DuckDBBackend(str(tmp_path), timezone="America/Los_Angeles")
+
+
+def test_local_columns_are_named_as_snowflake_names_them(duckdb_backend):
+    sql = 'SELECT COUNT(*), id, id AS s, id AS "Mixed" FROM HUBSPOT_DEV.DEALS GROUP BY id ORDER BY id'
+    assert duckdb_backend.execute(sql).columns == ["COUNT(*)", "ID", "S", "Mixed"]
+    assert list(duckdb_backend.describe(sql).columns) == ["COUNT(*)", "ID", "S", "Mixed"]
+
+
+def test_local_day_buckets_use_the_account_time_zone(duckdb_backend):
+    sql = "SELECT DATE(CONVERT_TIMEZONE('UTC', uuid_ts)) AS day FROM HUBSPOT_DEV.DEALS ORDER BY day"
+    days = duckdb_backend.execute(sql).table.column("DAY").to_pylist()
+    assert [str(day) for day in days] == ["2024-01-01", "2024-01-02"]
+
+
+def test_local_answers_are_cached_apart(duckdb_backend, monkeypatch):
+    from extract_cache import LocalFirstBackend
+    remote = _Backend()
+    remote.source_dialect = warehouse.DIALECT
+    backend = LocalFirstBackend(remote, duckdb_backend)
+    monkeypatch.setattr(backend, "routes_locally", lambda sql: "DEALS" in sql)
+    assert backend.namespace_for("SELECT id FROM HUBSPOT_DEV.DEALS") == duckdb_backend.namespace
+    assert backend.namespace_for("SELECT id FROM HUBSPOT_DEV.CONTACTS") == "fake"
+
+
+class _SlowBackend(_Backend):
+    def execute(self, sql, progress=None, timeout=None):
+        self.executed.append(timeout)
+        raise QueryTimeout(f"Query ran longer than {timeout}s and was cancelled.")
+
+
+def test_timeouts_are_classified_and_the_budget_reaches_the_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(warehouse, "get_result_cache", lambda: ResultCache(directory=str(tmp_path)))
+    backend = _SlowBackend()
+    error = execute_checked(backend, "SELECT n FROM t", timeout=12)
+    assert backend.executed == [12]
+    assert error.kind == "timeout"
+
+
+class _FakeJob:
+    def __init__(self, sql, config, table, polls=0):
+        self.sql = sql
+        self.config = config
+        self.job_id = f"job-{id(self)}"
+        self.total_bytes_processed = 2048
+        self.schema = [SimpleNamespace(name=name, mode="NULLABLE", field_type="INTEGER") for name in table.column_names]
+        self.cancelled = False
+        self._table = table
+        self._polls = polls
+
+    def done(self):
+        self._polls -= 1
+        return self._polls < 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def result(self, page_size=None):
+        table = self._table
+        return SimpleNamespace(schema=self.schema, total_rows=table.num_rows,
+                               to_arrow_iterable=lambda bqstorage_client=None: iter(table.to_batches(max_chunksize=2)))
+
+
+class _FakeBigQueryClient:
+    project = "rudderevents"
+
+    def __init__(self, polls=0):
+        self.jobs = []
+        self.cancelled = []
+        self.polls = polls
+
+    def query(self, sql, job_config=None):
+        job = _FakeJob(sql, job_config, pa.table({"n": [1, 2, 3]}), self.polls)
+        self.jobs.append(job)
+        return job
+
+    def cancel_job(self, job_id):
+        self.cancelled.append(job_id)
+
+
+@pytest.fixture
+def bigquery_client(monkeypatch):
+    # Job configs are recorded as plain dicts, so google-cloud-bigquery is not needed
+    monkeypatch.setattr(warehouse, "bigquery", SimpleNamespace(QueryJobConfig=lambda **options: options))
+    monkeypatch.setattr(warehouse, "_backends", {})
+    client = _FakeBigQueryClient()
+    backend = warehouse.get_bigquery_backend("key.json", "rudderevents",
+                                             connect=lambda path, project: warehouse.BigQueryBackend(client))
+    return client, backend
+
+
+def test_bigquery_runs_transpiled_snowflake_sql(bigquery_client):
+    client, backend = bigquery_client
+    result = backend.execute("SELECT n FROM t WHERE d >= DATEADD(day, -7, CURRENT_DATE())")
+    assert "DATE_ADD(CURRENT_DATE, INTERVAL -7 DAY)" in client.jobs[0].sql
+    assert client.jobs[0].config == {"use_query_cache": True}
+    assert result.total_rows == 3 and len(chart_frame(result)) == 3
+
+
+def test_bigquery_explain_is_a_dry_run(bigquery_client):
+    client, backend = bigquery_client
+    estimate = backend.explain("SELECT n FROM t")
+    assert client.jobs[0].config == {"dry_run": True, "use_query_cache": False}
+    assert estimate.bytes_assigned == 2048 and not estimate.full_scan
+
+
+def test_bigquery_cancel(bigquery_client):
+    client, backend = bigquery_client
+    backend.cancel("job-1")
+    assert client.cancelled == ["job-1"]
+
+
+def test_bigquery_job_is_cancelled_on_timeout(bigquery_client, monkeypatch):
+    client, backend = bigquery_client
+    client.polls = 1000
+    monkeypatch.setattr(warehouse, "POLL_INTERVAL_SECONDS", 0.01)
+    with pytest.raises(QueryTimeout):
+        backend.execute("SELECT n FROM t", timeout=0.05)
+    assert client.jobs[0].cancelled
@@ -0,0 +1,65 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "give", "get", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "per", "query", "show", "that", "the", "this", "to", "we", "what",
+    "when", "which", "with",
+}
+
+
+def tokenize(text):
+    """Lower-case word tokens; snake_case identifiers split into their words."""
+    tokens = []
+    for word in _WORD_RE.findall(str(text).lower()):
+        if word in STOPWORDS:
+            continue
+        # Light plural folding so "deals" matches "deal"
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class BM25Index:
+    """BM25 ranking over a fixed document set, stored as NumPy posting arrays."""
+
+    def __init__(self, documents=None, token_lists=None, k1=1.5, b=0.75):
+        if token_lists is None:
+            token_lists = [tokenize(doc) for doc in documents]
+        self.size = len(token_lists)
+        lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.float32)
+        avg_length = float(lengths.mean()) if self.size and lengths.sum() else 1.0
+        norm = k1 * (1 - b + b * lengths / avg_length)
+
+        doc_ids = defaultdict(list)
+        freqs = defaultdict(list)
+        for doc_id, tokens in enumerate(token_lists):
+            for term, tf in Counter(tokens).items():
+                doc_ids[term].append(doc_id)
+                freqs[term].append(tf)
+
+        self._postings = {}
+        for term, ids in doc_ids.items():
+            ids = np.array(ids, dtype=np.int32)
+            tf = np.array(freqs[term], dtype=np.float32)
+            idf = np.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            # Per-document term weights are precomputed so a query is a handful of scatter-adds
+            self._postings[term] = (ids, idf * tf * (k1 + 1) / (tf + norm[ids]))
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term, weight in Counter(tokenize(query)).items():
+            posting = self._postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1] * weight
+        return scores
+
+    def top_k(self, query, k):
+        """Indices of the k best-matching documents with a positive score, best first."""
+        scores = self.scores(query)
+        ranked = np.argsort(-scores, kind="stable")[:k]
+        return [int(i) for i in ranked if scores[i] > 0]
@@ -0,0 +1,567 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+from arrow_result import MAX_RESULT_BYTES, MAX_RESULT_ROWS, PAGE_ROWS, ArrowResult, PagedResult, StreamedResult, \
+    fetch_pages
+from connection_pool import get_pool
+from cost_guard import PlanEstimate, get_cost_guard, snowflake_explain
+from query_pipeline import POLL_INTERVAL_SECONDS, QUERY_TIMEOUT_SECONDS, QueryCancelled, QueryError, QueryProgress, \
+    QueryTimeout, cancel_query, empty_frame, run_async
+from result_cache import get_result_cache
+from sql_validator import DIALECT, validate_sql
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:
+    sqlglot = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    from google.cloud import bigquery
+except ImportError:
+    bigquery = None
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+# Which backend the agents use: snowflake, bigquery or duckdb
+BACKEND = os.environ.get("DBAGENT_BACKEND", "snowflake")
+# Local Parquet extracts, laid out as <database>/<schema>/<table>/*.parquet
+EXTRACT_DIR = os.environ.get("DBAGENT_EXTRACT_DIR", os.path.join(".dbagent_cache", "extracts"))
+# Database that unqualified schema.table names resolve against, as in the Snowflake session
+DEFAULT_DATABASE = "RUDDER_EVENTS"
+# Session time zone of the Snowflake account, which local queries use too so day buckets agree
+SNOWFLAKE_TIMEZONE = os.environ.get("DBAGENT_SNOWFLAKE_TIMEZONE", "America/Los_Angeles")
+# Endpoint of a local BigQuery emulator (e.g. http://localhost:9050); when set no Google credentials are used
+BIGQUERY_EMULATOR_HOST = os.environ.get("DBAGENT_BIGQUERY_EMULATOR_HOST")
+
+# Snowflake connection settings. Each is taken from the DBAGENT_SNOWFLAKE_<KEY> variable,
+# else the [snowflake] section of the settings (the Streamlit secrets), else the agent's defaults:
+#
+#   [credentials]
+#   sf_password = "..."        # still read when [snowflake] has no password
+#
+#   [snowflake]                # every key optional
+#   account = "..."
+#   user = "..."
+#   password = "..."
+#   warehouse = "..."
+#   database = "..."
+#   role = "..."
+#
+# DBAGENT_BACKEND=bigquery reads its service account from the [bigquery] section:
+#
+#   [bigquery]
+#   credentials_path = "rudderevents-d409acb5f033.json"
+#   project_id = "rudderevents"
+SNOWFLAKE_SETTINGS = ("user", "password", "account", "warehouse", "database", "role")
+
+# Arrow types for BigQuery column types, used to describe an empty result
+_BIGQUERY_ARROW_TYPES = {
+    "STRING": pa.string(),
+    "BYTES": pa.binary(),
+    "INTEGER": pa.int64(),
+    "INT64": pa.int64(),
+    "FLOAT": pa.float64(),
+    "FLOAT64": pa.float64(),
+    "NUMERIC": pa.decimal128(38, 9),
+    "BIGNUMERIC": pa.decimal256(76, 38),
+    "BOOLEAN": pa.bool_(),
+    "BOOL": pa.bool_(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "DATETIME": pa.timestamp("us"),
+    "DATE": pa.date32(),
+    "TIME": pa.time64("us"),
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def snowflake_column_names(sql, names):
+    """Result column names as Snowflake gives them for sql, or names when they cannot be worked out.
+
+    Snowflake upper-cases unquoted identifiers and names an unaliased expression
+    after its text (COUNT(*)); DuckDB keeps aliases as written and names
+    expressions its own way (count_star()).
+    """
+    if sqlglot is None:
+        return names
+    try:
+        selects = sqlglot.parse_one(sql, read=DIALECT).selects
+    except Exception:
+        return names
+    if len(selects) != len(names) or any(expression.is_star for expression in selects):
+        return names
+    renamed = []
+    for expression in selects:
+        if isinstance(expression, (exp.Alias, exp.Column)):
+            identifier = expression.args["alias"] if isinstance(expression, exp.Alias) else expression.this
+            renamed.append(identifier.name if identifier.quoted else identifier.name.upper())
+        else:
+            renamed.append(expression.sql(dialect=DIALECT).upper())
+    return renamed
+
+
+def transpile(sql, read, write):
+    """sql rewritten from one dialect to another; returned unchanged when sqlglot is missing or cannot parse it."""
+    if sqlglot is None or read == write:
+        return sql
+    try:
+        return ";\n".join(sqlglot.transpile(sql, read=read, write=write))
+    except Exception:
+        return sql
+
+
+class WarehouseBackend:
+    """A place to run the agents' SQL.
+
+    Every backend can hand out a native connection, run a query to a (paged)
+    ArrowResult, stream its record batches, price it before it runs, describe
+    its columns without running it, and cancel it while it runs. SQL is written
+    in source_dialect; backends with another native dialect translate it.
+    """
+
+    kind = None
+    source_dialect = DIALECT
+
+    @property
+    def namespace(self):
+        """Result-cache namespace: results are only shared between identical backends."""
+        raise NotImplementedError
+
+    def namespace_for(self, sql):
+        """Result-cache namespace of sql's answer; backends that route queries give the engine's."""
+        return self.namespace
+
+    def connection(self):
+        raise NotImplementedError
+
+    def execute(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        raise NotImplementedError
+
+    def stream_batches(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        raise NotImplementedError
+
+    def explain(self, sql):
+        raise NotImplementedError
+
+    def describe(self, sql):
+        raise NotImplementedError
+
+    def cancel(self, query_id):
+        raise NotImplementedError
+
+
+class SnowflakeBackend(WarehouseBackend):
+    """Snowflake through the process-wide connection pool for these parameters."""
+
+    kind = "snowflake"
+
+    def __init__(self, connect_params, connect=None):
+        self.connect_params = dict(connect_params)
+        self.pool = get_pool(connect=connect, **self.connect_params)
+
+    @property
+    def namespace(self):
+        params = self.connect_params
+        return f"{params.get('account')}/{params.get('database')}/{params.get('role')}"
+
+    def connection(self):
+        return self.pool.connection()
+
+    def execute(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Runs asynchronously so it can be timed out or cancelled on the server
+            run_async(conn, cursor, sql, progress, timeout)
+            # Result batches download independently of the cursor, so later pages load after it is closed
+            result = fetch_pages(cursor)
+            cursor.close()
+        return result
+
+    def stream_batches(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                run_async(conn, cursor, sql, progress, timeout)
+                for table in cursor.fetch_arrow_batches():
+                    yield from table.to_batches()
+            finally:
+                cursor.close()
+
+    def explain(self, sql):
+        with self.connection() as conn:
+            return snowflake_explain(conn, sql)
+
+    def describe(self, sql):
+        # Column names and types from Snowflake's compile step, without running the query
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            description = cursor.describe(sql)
+            cursor.close()
+        return empty_frame(description)
+
+    def cancel(self, query_id):
+        with self.connection() as conn:
+            cancel_query(conn, query_id)
+
+
+def bigquery_arrow_schema(fields):
+    """Arrow schema for BigQuery SchemaFields; repeated and nested fields are described as strings."""
+    return pa.schema([
+        pa.field(field.name, pa.string() if field.mode == "REPEATED"
+                 else _BIGQUERY_ARROW_TYPES.get(field.field_type, pa.string()))
+        for field in fields
+    ])
+
+
+class BigQueryBackend(WarehouseBackend):
+    """BigQuery, with results read as Arrow.
+
+    Results are streamed through the Storage Read API when its client is
+    available, and repeated queries are answered from BigQuery's own result cache.
+    The agents' Snowflake SQL is transpiled; pass source_dialect="bigquery" to
+    send SQL written for BigQuery unchanged.
+    """
+
+    kind = "bigquery"
+
+    def __init__(self, client, read_client=None, source_dialect=DIALECT):
+        self.client = client
+        self.read_client = read_client
+        self.source_dialect = source_dialect
+
+    def _native(self, sql):
+        return transpile(sql, self.source_dialect, "bigquery")
+
+    @property
+    def namespace(self):
+        return f"bigquery/{self.client.project}"
+
+    @contextmanager
+    def connection(self):
+        # The client is thread-safe and shared; there is nothing to check out
+        yield self.client
+
+    def _run(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        """Start sql as a query job and poll it, cancelling it on timeout or when progress is cancelled."""
+        if progress is None:
+            progress = QueryProgress()
+        if progress.cancelled:
+            raise QueryCancelled("Query cancelled before it started.")
+        job = self.client.query(self._native(sql), job_config=bigquery.QueryJobConfig(use_query_cache=True))
+        progress.query_id = job.job_id
+        while not job.done():
+            if progress.cancelled or progress.elapsed > timeout:
+                job.cancel()
+                if progress.cancelled:
+                    raise QueryCancelled("Query cancelled.")
+                raise QueryTimeout(f"Query ran longer than {timeout}s and was cancelled.")
+            time.sleep(POLL_INTERVAL_SECONDS)
+        progress.bytes_scanned = job.total_bytes_processed
+        return job
+
+    def execute(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS, page_rows=PAGE_ROWS,
+                max_rows=MAX_RESULT_ROWS, max_bytes=MAX_RESULT_BYTES):
+        # Raises the job's error, if it failed
+        rows = self._run(sql, progress, timeout).result(page_size=page_rows)
+        empty_table = bigquery_arrow_schema(rows.schema).empty_table()
+        if not rows.total_rows:
+            return ArrowResult(empty_table)
+        batches = rows.to_arrow_iterable(bqstorage_client=self.read_client)
+        return StreamedResult(batches, empty_table, rows.total_rows, page_rows, max_rows, max_bytes)
+
+    def stream_batches(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        rows = self._run(sql, progress, timeout).result(page_size=PAGE_ROWS)
+        yield from rows.to_arrow_iterable(bqstorage_client=self.read_client)
+
+    def explain(self, sql):
+        """PlanEstimate from a dry run, which validates and prices the query without running it."""
+        job = self.client.query(self._native(sql), job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+        # Dry runs report bytes but not partitions, so a query never counts as a full scan
+        return PlanEstimate(0, 0, job.total_bytes_processed or 0)
+
+    def describe(self, sql):
+        job = self.client.query(self._native(sql), job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+        return bigquery_arrow_schema(job.schema).empty_table().to_pandas()
+
+    def cancel(self, query_id):
+        self.client.cancel_job(query_id)
+
+
+class _ArrowBatch:
+    # Snowflake result-batch interface (rowcount, to_arrow) over a batch already in memory
+    def __init__(self, batch):
+        self.batch = batch
+        self.rowcount = batch.num_rows
+
+    def to_arrow(self):
+        return pa.Table.from_batches([self.batch])
+
+
+class DuckDBBackend(WarehouseBackend):
+    """In-process DuckDB over local Parquet extracts, for offline use and cheap exploratory queries.
+
+    Each <database>/<schema>/<table> directory under extract_dir becomes a view
+    of the same name, so generated Snowflake SQL runs unchanged after it is
+    transpiled to DuckDB.
+    """
+
+    kind = "duckdb"
+
+    def __init__(self, extract_dir=EXTRACT_DIR, default_database=DEFAULT_DATABASE, timezone=SNOWFLAKE_TIMEZONE):
+        self.extract_dir = extract_dir
+        self.default_database = default_database
+        self.timezone = timezone
+        self.conn = duckdb.connect(":memory:")
+        self.tables = []
+        self._running = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def namespace(self):
+        return f"duckdb/{os.path.abspath(self.extract_dir)}"
+
+    def refresh(self):
+        """(Re)create a view for every extracted table, picking up new and rewritten Parquet files."""
+        tables = []
+        with self._lock:
+            databases = set()
+            for root, _, files in os.walk(self.extract_dir):
+                parts = os.path.relpath(root, self.extract_dir).split(os.sep)
+                if len(parts) != 3 or not any(name.endswith(".parquet") for name in files):
+                    continue
+                database, schema, table = parts
+                if database not in databases:
+                    self.conn.execute(f'ATTACH IF NOT EXISTS \':memory:\' AS "{database}"')
+                    databases.add(database)
+                self.conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{database}"."{schema}"')
+                pattern = os.path.join(root, "*.parquet").replace("'", "''")
+                self.conn.execute(f'CREATE OR REPLACE VIEW "{database}"."{schema}"."{table}" AS '
+                                  f"SELECT * FROM read_parquet('{pattern}', union_by_name = true)")
+                tables.append(".".join(parts))
+            self.tables = tables
+        return tables
+
+    @contextmanager
+    def connection(self):
+        # Each caller gets its own cursor on the shared in-memory database
+        cursor = self.conn.cursor()
+        try:
+            # Session settings are per cursor; CONVERT_TIMEZONE becomes AT TIME ZONE, which reads this
+            cursor.execute(f"SET TimeZone = '{self.timezone}'")
+            if self.default_database in {t.split(".")[0] for t in self.tables}:
+                cursor.execute(f'USE "{self.default_database}"')
+            yield cursor
+        finally:
+            cursor.close()
+
+    def _watch(self, cursor, progress, timeout, done):
+        while not done.wait(POLL_INTERVAL_SECONDS):
+            if progress.cancelled or progress.elapsed > timeout:
+                cursor.interrupt()
+                return
+
+    def _run(self, cursor, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        if progress is None:
+            progress = QueryProgress()
+        if progress.cancelled:
+            raise QueryCancelled("Query cancelled before it started.")
+        progress.query_id = uuid.uuid4().hex
+        done = threading.Event()
+        self._running[progress.query_id] = cursor
+        threading.Thread(target=self._watch, args=(cursor, progress, timeout, done), daemon=True).start()
+        try:
+            return cursor.execute(transpile(sql, self.source_dialect, "duckdb"))
+        except duckdb.InterruptException:
+            if progress.cancelled:
+                raise QueryCancelled("Query cancelled.")
+            raise QueryTimeout(f"Query ran longer than {timeout}s and was cancelled.")
+        finally:
+            done.set()
+            self._running.pop(progress.query_id, None)
+
+    def execute(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        with self.connection() as cursor:
+            table = self._run(cursor, sql, progress, timeout).fetch_arrow_table()
+        if self.source_dialect == DIALECT:
+            # Same column names as the warehouse, so chart rules and cached chart code match either way
+            table = table.rename_columns(snowflake_column_names(sql, table.column_names))
+        # The result is already in memory; paging only keeps what is shown to the row and byte caps
+        return PagedResult([_ArrowBatch(b) for b in table.to_batches(max_chunksize=PAGE_ROWS)],
+                           table.schema.empty_table())
+
+    def stream_batches(self, sql, progress=None, timeout=QUERY_TIMEOUT_SECONDS):
+        with self.connection() as cursor:
+            reader = self._run(cursor, sql, progress, timeout).fetch_record_batch(PAGE_ROWS)
+            names = reader.schema.names
+            if self.source_dialect == DIALECT:
+                names = snowflake_column_names(sql, names)
+            for batch in reader:
+                yield pa.RecordBatch.from_arrays(batch.columns, names=names)
+
+    def explain(self, sql):
+        # Local scans cost nothing
+        return PlanEstimate(0, 0, 0)
+
+    def describe(self, sql):
+        with self.connection() as cursor:
+            query = transpile(sql, self.source_dialect, "duckdb").rstrip().rstrip(";")
+            frame = cursor.execute(f"SELECT * FROM ({query}) LIMIT 0").fetch_arrow_table().to_pandas()
+        if self.source_dialect == DIALECT:
+            frame.columns = snowflake_column_names(sql, list(frame.columns))
+        return frame
+
+    def is_running(self, query_id):
+        return query_id in self._running
+
+    def cancel(self, query_id):
+        cursor = self._running.get(query_id)
+        if cursor is not None:
+            cursor.interrupt()
+
+
+def _section(settings, name):
+    try:
+        return dict(settings[name])
+    except (KeyError, TypeError):
+        return {}
+
+
+def snowflake_params(settings, defaults=None):
+    """Connection parameters from DBAGENT_SNOWFLAKE_* variables, the [snowflake] settings section, then defaults."""
+    section = _section(settings, "snowflake")
+    defaults = defaults or {}
+    params = {}
+    for key in SNOWFLAKE_SETTINGS:
+        value = os.environ.get(f"DBAGENT_SNOWFLAKE_{key.upper()}", section.get(key, defaults.get(key)))
+        if value is not None:
+            params[key] = value
+    if "password" not in params:
+        # Older deployments keep only the password, under [credentials]
+        password = _section(settings, "credentials").get("sf_password")
+        if password is not None:
+            params["password"] = password
+    return params
+
+
+def _bigquery_backend(credentials_path, project_id):
+    if BIGQUERY_EMULATOR_HOST:
+        from google.api_core.client_options import ClientOptions
+        from google.auth.credentials import AnonymousCredentials
+        client = bigquery.Client(project=project_id, credentials=AnonymousCredentials(),
+                                 client_options=ClientOptions(api_endpoint=BIGQUERY_EMULATOR_HOST))
+        # The emulator serves results over REST only
+        return BigQueryBackend(client)
+    from google.oauth2 import service_account
+    credentials = service_account.Credentials.from_service_account_file(
+        credentials_path, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    # Both clients share one set of credentials, so the token is refreshed once for the two
+    client = bigquery.Client(project=project_id, credentials=credentials)
+    read_client = None
+    if bigquery_storage is not None:
+        read_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+    return BigQueryBackend(client, read_client)
+
+
+def get_bigquery_backend(credentials_path, project_id, connect=None):
+    """Return the process-wide BigQuery backend, creating its clients on first use.
+
+    connect(credentials_path, project_id) may return any BigQueryBackend, which
+    lets a fake client stand in for BigQuery.
+    """
+    key = ("bigquery", credentials_path, project_id, BIGQUERY_EMULATOR_HOST)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = (connect or _bigquery_backend)(credentials_path, project_id)
+        return backend
+
+
+def get_duckdb_backend(extract_dir=EXTRACT_DIR):
+    """Return the process-wide DuckDB backend over extract_dir."""
+    key = ("duckdb", os.path.abspath(extract_dir))
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = DuckDBBackend(extract_dir)
+        return backend
+
+
+def get_backend(kind=None, settings=None, snowflake_defaults=None):
+    """Backend of the given kind (DBAGENT_BACKEND by default), configured from settings such as st.secrets.
+
+    snowflake_defaults fills in Snowflake settings that neither the environment nor settings give.
+    """
+    kind = (kind or BACKEND).lower()
+    settings = settings if settings is not None else {}
+    if kind == "snowflake":
+        return SnowflakeBackend(snowflake_params(settings, snowflake_defaults))
+    if kind == "bigquery":
+        section = _section(settings, "bigquery")
+        return get_bigquery_backend(section.get("credentials_path"), section.get("project_id"))
+    if kind == "duckdb":
+        return get_duckdb_backend(_section(settings, "duckdb").get("extract_dir", EXTRACT_DIR))
+    raise ValueError(f"Unknown warehouse backend '{kind}'")
+
+
+def execute_checked(backend, query, progress=None, warn=None, timeout=QUERY_TIMEOUT_SECONDS):
+    """Run an agent's query on backend: local validation, result cache, cost guard, then the query itself.
+
+    Returns the result, or a QueryError saying what went wrong and of which
+    kind. warn(text) shows validation warnings and the cost guard's notes to
+    the user; the query is cancelled after timeout seconds.
+    """
+    # Syntax and schema mistakes are caught locally, without a warehouse round trip
+    if backend.source_dialect == DIALECT:
+        validation = validate_sql(query)
+        if not validation.ok:
+            return QueryError(validation.message(), "invalid")
+        if validation.warnings and warn is not None:
+            # Joins off the known keys still run, but the user is told
+            warn(validation.warning())
+    cached = get_result_cache().get(query, namespace=backend.namespace_for(query))
+    if cached is not None:
+        return cached
+    try:
+        # Queries over the scan-size thresholds are narrowed or rejected before they run
+        decision = get_cost_guard().check(query, backend.explain)
+        if decision.rejected:
+            return QueryError("Query rejected by the cost guard: " + decision.message(), "rejected")
+        if decision.notes and warn is not None:
+            warn(decision.message())
+        if decision.sql != query:
+            # A narrowed query is cached under its own text, never as the answer to the original
+            cached = get_result_cache().get(decision.sql, namespace=backend.namespace_for(decision.sql))
+            if cached is not None:
+                return cached
+        namespace = backend.namespace_for(decision.sql)
+        # Kept as Arrow and fetched a page at a time; pandas columns are only built for charts
+        result = backend.execute(decision.sql, progress, timeout)
+        # Partly loaded results are not cached, so a hit always holds every row
+        if result.complete:
+            get_result_cache().put(decision.sql, result, namespace=namespace)
+        elif isinstance(result, PagedResult):
+            # Cached once the rest is loaded, for its chart or by the user
+            result.on_complete = lambda loaded: get_result_cache().put(decision.sql, loaded, namespace=namespace)
+        return result
+    except QueryTimeout as e:
+        return QueryError(str(e), "timeout")
+    except QueryCancelled as e:
+        return QueryError(str(e), "cancelled")
+    except Exception as e:
+        return QueryError(str(e))